@@ -0,0 +1,77 @@
+"""
+compare the cost of decoding api responses of typical sizes
+
+    python benchmarks/bench_json.py
+
+"text" is the old path (decode the body to text, then json.loads);
+"bytes" parses the body bytes with the stdlib; "fastjson" is
+bitly_api.fastjson.loads with whichever backend is installed.
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from bitly_api import fastjson
+
+
+def link(i):
+    return {'link': 'http://bit.ly/%x' % i,
+            'aggregate_link': 'http://bit.ly/a',
+            'long_url': 'http://example.com/some/long/path?id=%d' % i,
+            'title': u'a page title – number %d' % i, 'archived': False,
+            'private': False, 'created_at': 1360000000 + i,
+            'user_ts': 1360000000 + i, 'modified_at': 1360000000 + i,
+            'client_id': 'a5e8cebb233c5d07e5c553e917dffb92',
+            'tags': ['one', 'two'], 'encoding_user': {'login': 'someone'}}
+
+
+def response(data):
+    return json.dumps({'status_code': 200, 'status_txt': 'OK',
+                       'data': data}).encode('utf-8')
+
+
+PAYLOADS = [
+    ('expand', response({'expand': [{'short_url': 'http://bit.ly/a',
+                                     'long_url': 'http://example.com/'}]})),
+    ('link_history 50', response({'link_history': [link(i)
+                                                   for i in range(50)]})),
+    ('link_history 1000', response({'link_history': [link(i)
+                                                     for i in range(1000)]})),
+]
+
+
+def text_path(body):
+    result = body.decode('utf-8')
+    if result.startswith('{'):
+        return json.loads(result)
+
+
+def bytes_path(body):
+    if body.startswith(b'{'):
+        return fastjson.stdlib_loads(body)
+
+
+def fast_path(body):
+    if body.startswith(b'{'):
+        return fastjson.loads(body)
+
+
+def main():
+    print('fastjson backend: %s' % fastjson.BACKEND)
+    print('%-18s %9s %12s %12s %12s' % ('payload', 'bytes', 'text us',
+                                        'bytes us', 'fastjson us'))
+    for name, body in PAYLOADS:
+        number = max(10, 2000000 // len(body))
+        row = []
+        for func in (text_path, bytes_path, fast_path):
+            best = min(timeit.repeat(lambda: func(body), number=number,
+                                     repeat=5))
+            row.append(best / number * 1e6)
+        print('%-18s %9d %12.1f %12.1f %12.1f' % ((name, len(body)) +
+                                                  tuple(row)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+measure the client side overhead of an api call, with the network mocked
+
+    python benchmarks/bench_requests.py
+
+every call goes through the whole Connection pipeline (parameter checks,
+request building, rate limiting and retry bookkeeping, response parsing)
+against a connection pool that answers instantly from memory. "full" builds
+every request path from scratch as before; "cached" is the default, which
+reuses the encoded method, format and credential part of the path.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import bitly_api
+
+BODY = (b'{"status_code": 200, "status_txt": "OK", "data": {"expand": '
+        b'[{"hash": "abc", "long_url": "http://example.com/"}], '
+        b'"link_clicks": 3, "url": "http://bit.ly/abc", "hash": "abc"}}')
+
+
+class FakeResponse(object):
+    status = 200
+
+
+class FakePool(object):
+    """a connection pool answering every request without the network"""
+
+    def __init__(self, host, scheme='http', maxsize=10, idle_timeout=60):
+        pass
+
+    def urlopen(self, path, headers=None, connect_timeout=None,
+                read_timeout=None, timings=None):
+        return FakeResponse, BODY
+
+    def close(self):
+        pass
+
+
+class FullBuildConnection(bitly_api.Connection):
+    """builds every path from scratch, like the client used to"""
+
+    def _build_request(self, host, method, params, secret=None):
+        return self._build_full_request(host, method, params, secret)
+
+
+CALLS = [
+    ('expand', lambda c: c.expand(hash='abc')),
+    ('shorten', lambda c: c.shorten('http://example.com/a/long/path')),
+    ('link_clicks', lambda c: c.link_clicks('http://bit.ly/abc', unit='day',
+                                            units=7, rollup=True)),
+]
+
+
+def rate(connection, call, seconds=1.0):
+    """calls per second made over `seconds`"""
+    count = 0
+    started = time.time()
+    while True:
+        for _ in range(200):
+            call(connection)
+        count += 200
+        elapsed = time.time() - started
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def main():
+    print('%-14s %12s %12s' % ('call', 'full req/s', 'cached req/s'))
+    for name, call in CALLS:
+        row = []
+        for cls in (FullBuildConnection, bitly_api.Connection):
+            auth = dict(access_token='token') if name == 'link_clicks' else \
+                dict(login='bitlyapidemo',
+                     api_key='R_0da49e0a9118ff35f52f629d2d71bf07')
+            connection = cls(**auth)
+            connection._pool_class = FakePool
+            row.append(rate(connection, call))
+        print('%-14s %12.0f %12.0f' % ((name,) + tuple(row)))
+
+
+if __name__ == '__main__':
+    main()
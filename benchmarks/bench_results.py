@@ -0,0 +1,57 @@
+"""
+compare the memory held by expand and link history results kept as dicts
+and as the compact result objects of bitly_api.results
+
+    python benchmarks/bench_results.py [count]
+
+needs python 3.4+ (tracemalloc).
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from bitly_api.results import ExpandResult, LinkHistoryEntry
+
+
+def expand_entry(i):
+    return {'short_url': 'http://bit.ly/%x' % i, 'hash': '%x' % i,
+            'user_hash': '%x' % i, 'global_hash': 'g%x' % i,
+            'long_url': 'http://example.com/%d' % i}
+
+
+def history_entry(i):
+    return {'link': 'http://bit.ly/%x' % i,
+            'aggregate_link': 'http://bit.ly/a',
+            'long_url': 'http://example.com/%d' % i, 'title': 'title',
+            'archived': False, 'private': False, 'created_at': i,
+            'modified_at': i, 'user_ts': i, 'client_id': 'client',
+            'tags': []}
+
+
+def measure(wrap, entries):
+    """bytes held per record by `wrap(entry)`, excluding the field values"""
+    gc.collect()
+    tracemalloc.start()
+    held = [wrap(entry) for entry in entries]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size / float(len(entries))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('%-18s %12s %12s' % ('record', 'dict B', 'slots B'))
+    for name, entry, cls in [('expand', expand_entry, ExpandResult),
+                             ('link_history', history_entry,
+                              LinkHistoryEntry)]:
+        entries = [entry(i) for i in range(count)]
+        as_dict = measure(dict, entries)
+        as_slots = measure(cls, entries)
+        print('%-18s %12.0f %12.0f' % (name, as_dict, as_slots))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+a local stand-in for the bitly v3 api, for benchmarks and load tests
+
+    server = MockServer(latency=0.005, error_rate=0.01).start()
+    c = server.connection()                    # login / apiKey
+    c = server.connection(access_token='t')    # oauth endpoints, over http
+    ...
+    server.stop()
+
+every response is generated from the request, so any hash, link or url is
+valid. `latency` (plus up to `jitter`) seconds are slept before answering,
+a fraction `error_rate` of requests fail with a transient 503, and a
+fraction `rate_limit_rate` with RATE_LIMIT_EXCEEDED. `title_size` pads the
+titles in link history and info, and `max_history` is the number of links
+the user has.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import bitly_api
+from bitly_api.pool import HTTPConnectionPool
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+# the newest link in the mock user's history
+NEWEST = 1400000000
+
+
+def _first(query, name, default=None):
+    return query.get(name, [default])[0]
+
+
+def _short_url(h):
+    return 'http://bit.ly/' + h
+
+
+def _link(server, created_at):
+    h = '%x' % created_at
+    return {'link': _short_url(h), 'aggregate_link': _short_url('a' + h),
+            'long_url': 'http://example.com/%d' % created_at,
+            'title': 'a' * server.title_size, 'archived': False,
+            'private': False, 'created_at': created_at,
+            'modified_at': created_at, 'user_ts': created_at,
+            'client_id': 'a5e8cebb233c5d07e5c553e917dffb92', 'tags': []}
+
+
+def _lookup_entries(query, entry):
+    entries = []
+    for short_url in query.get('shortUrl', []):
+        entries.append(dict(entry(short_url.rsplit('/', 1)[-1]),
+                            short_url=short_url))
+    for h in query.get('hash', []):
+        entries.append(dict(entry(h), hash=h))
+    return entries
+
+
+def shorten(server, query):
+    long_url = _first(query, 'longUrl') or _first(query, 'uri')
+    h = '%07x' % (hash(long_url) & 0xfffffff)
+    return {'url': _short_url(h), 'hash': h, 'global_hash': 'g' + h,
+            'long_url': long_url, 'new_hash': 0}
+
+
+def expand(server, query):
+    return {'expand': _lookup_entries(query, lambda h: {
+        'user_hash': h, 'global_hash': 'g' + h,
+        'long_url': 'http://example.com/' + h})}
+
+
+def info(server, query):
+    return {'info': _lookup_entries(query, lambda h: {
+        'user_hash': h, 'global_hash': 'g' + h,
+        'title': 'a' * server.title_size, 'created_by': 'someone',
+        'created_at': NEWEST})}
+
+
+def link_clicks(server, query):
+    units = int(_first(query, 'units', 1))
+    if _first(query, 'rollup') == 'true':
+        return {'link_clicks': units * 3}
+    unit_reference_ts = NEWEST - NEWEST % 86400
+    return {'link_clicks': [{'dt': unit_reference_ts - i * 86400, 'clicks': 3}
+                            for i in range(max(units, 1))]}
+
+
+def link_countries(server, query):
+    return {'countries': [{'country': c, 'clicks': i + 1}
+                          for i, c in enumerate(['US', 'DE', 'FR', 'JP'])]}
+
+
+def user_info(server, query):
+    return {'login': 'mock', 'member_since': NEWEST - server.max_history}
+
+
+def user_link_history(server, query):
+    created_before = int(_first(query, 'created_before', NEWEST + 1))
+    created_after = int(_first(query, 'created_after', 0))
+    limit = int(_first(query, 'limit', 50))
+    offset = int(_first(query, 'offset', 0))
+    # one link a second, the oldest created at NEWEST - max_history + 1
+    newest = min(NEWEST, created_before - 1) - offset
+    oldest = max(NEWEST - server.max_history + 1, created_after + 1)
+    links = [_link(server, t)
+             for t in range(newest, max(oldest, newest - limit + 1) - 1, -1)]
+    return {'link_history': links, 'result_count': len(links)}
+
+
+ENDPOINTS = {
+    '/v3/shorten': shorten,
+    '/v3/expand': expand,
+    '/v3/info': info,
+    '/v3/link/clicks': link_clicks,
+    '/v3/link/countries': link_countries,
+    '/v3/user/info': user_info,
+    '/v3/user/link_history': user_link_history,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; don't let nagle hold the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.mock
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server.count(url.path)
+        delay = server.latency + random.random() * server.jitter
+        if delay:
+            time.sleep(delay)
+        endpoint = ENDPOINTS.get(url.path)
+        roll = random.random()
+        if endpoint is None:
+            data = {'status_code': 404, 'status_txt': 'NOT_FOUND',
+                    'data': None}
+        elif roll < server.error_rate:
+            data = {'status_code': 503, 'status_txt': 'UNKNOWN_ERROR',
+                    'data': None}
+        elif roll < server.error_rate + server.rate_limit_rate:
+            data = {'status_code': 403, 'status_txt': 'RATE_LIMIT_EXCEEDED',
+                    'data': None}
+        else:
+            data = {'status_code': 200, 'status_txt': 'OK',
+                    'data': endpoint(server, query)}
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class PlainHTTPConnectionPool(HTTPConnectionPool):
+    """an HTTPConnectionPool that uses plain http even for https calls"""
+
+    def __init__(self, host, scheme='http', maxsize=10, idle_timeout=60):
+        HTTPConnectionPool.__init__(self, host, 'http', maxsize, idle_timeout)
+
+
+class MockServer(object):
+    """a threaded local http server answering like the bitly v3 api"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, title_size=40, max_history=5000,
+                 port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.title_size = title_size
+        self.max_history = max_history
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._httpd = _HTTPServer(('127.0.0.1', port), Handler)
+        self._httpd.mock = self
+        self.host = '127.0.0.1:%d' % self._httpd.server_address[1]
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self):
+        thread = threading.Thread(target=self._httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def connection(self, cls=None, **kwargs):
+        """
+        a Connection (or `cls`) talking to this server. with an
+        access_token, oauth calls are sent over plain http too.
+        """
+        cls = cls or bitly_api.Connection
+        if 'access_token' not in kwargs:
+            kwargs.setdefault('login', 'mock')
+            kwargs.setdefault('api_key', 'R_mock')
+        connection = cls(**kwargs)
+        connection.host = connection.ssl_host = self.host
+        if not _is_async(cls):
+            connection._pool_class = PlainHTTPConnectionPool
+        else:
+            from bitly_api.aio import AsyncHTTPConnectionPool
+
+            class PlainAsyncPool(AsyncHTTPConnectionPool):
+                def __init__(self, host, scheme='http', maxsize=10,
+                             idle_timeout=60):
+                    AsyncHTTPConnectionPool.__init__(self, host, 'http',
+                                                     maxsize, idle_timeout)
+            connection._pool_class = PlainAsyncPool
+        return connection
+
+
+def _is_async(cls):
+    aio = getattr(bitly_api, 'AsyncConnection', None)
+    return aio is not None and issubclass(cls, aio)
+
+
+if __name__ == '__main__':
+    server = MockServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print('mock bitly api on http://%s/' % server.host)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,112 @@
+"""
+replay recorded api traffic at increasing speeds to find where the client
+saturates
+
+    python benchmarks/replay.py traffic.ndjson [--speeds 1,2,5,10,0]
+                                [--concurrency 1,4,16] [--latency-scale 1]
+                                [--output curve.json]
+
+traffic.ndjson is a recording made with bitly_api.RecordingTransport. calls
+are answered by a ReplayTransport (no network) delayed by their recorded
+latency times --latency-scale, and driven at each speed (0: as fast as
+possible) and concurrency. with --record N, a recording of N calls is first
+made against a local mock server (benchmarks/mockserver.py).
+
+prints one line per point and writes the curve as json.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from mockserver import MockServer, NEWEST, PlainHTTPConnectionPool
+import bitly_api
+from bitly_api.transport import (HTTPTransport, read_records,
+                                 throughput_curve)
+
+
+def record(path, calls, rate, latency):
+    """record `calls` mixed calls, made at about `rate` a second"""
+    server = MockServer(latency=latency, jitter=latency).start()
+    try:
+        with open(path, 'w') as f:
+            transport = bitly_api.RecordingTransport(
+                f, HTTPTransport(PlainHTTPConnectionPool))
+            c = server.connection(access_token='mock', transport=transport)
+            for i in range(calls):
+                roll = random.random()
+                if roll < 0.4:
+                    c.expand(hash='%07x' % random.randrange(1000))
+                elif roll < 0.7:
+                    c.shorten('http://example.com/%d' % i)
+                elif roll < 0.9:
+                    c.link_clicks('http://bit.ly/%07x' % i, rollup=True)
+                else:
+                    c.user_link_history(
+                        created_before=NEWEST - random.randrange(1000))
+                time.sleep(random.expovariate(rate))
+    finally:
+        server.stop()
+
+
+def _numbers(text, cast):
+    return [cast(value) or None for value in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('recording')
+    parser.add_argument('--speeds', default='1,2,5,10,20,50,0')
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--record', type=int, metavar='N',
+                        help='first record N calls against a mock server')
+    parser.add_argument('--record-rate', type=float, default=50,
+                        help='calls a second while recording')
+    parser.add_argument('--record-latency', type=float, default=0.005)
+    parser.add_argument('--output', help='write the json here')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.recording, args.record, args.record_rate,
+               args.record_latency)
+    records = read_records(args.recording)
+    transport = bitly_api.ReplayTransport(records,
+                                          latency_scale=args.latency_scale)
+    # plenty of idle connections, so the pool isn't what is measured
+    c = bitly_api.Connection(access_token='replay', pool_size=256,
+                             transport=transport)
+
+    sys.stderr.write('%6s %5s %10s %10s %9s %9s %6s\n' % (
+        'speed', 'conc', 'offered/s', 'achieved/s', 'p50 ms', 'p99 ms',
+        'errors'))
+    curve = []
+    for point in throughput_curve(c, records,
+                                  _numbers(args.speeds, float),
+                                  _numbers(args.concurrency, int)):
+        curve.append(point)
+        sys.stderr.write('%6s %5d %10s %10.1f %9.2f %9.2f %6d\n' % (
+            point['speed'] or 'max', point['concurrency'],
+            '%.1f' % point['offered_rate'] if point['offered_rate'] else '-',
+            point['achieved_rate'], point['latency_p50'] * 1000,
+            point['latency_p99'] * 1000, point['errors']))
+
+    document = dict(
+        bitly_api=bitly_api.__version__, python=platform.python_version(),
+        recording=args.recording, calls=len(records),
+        latency_scale=args.latency_scale, created=int(time.time()),
+        curve=curve)
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
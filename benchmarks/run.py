@@ -0,0 +1,233 @@
+"""
+offline client benchmark suite, run against benchmarks/mockserver.py
+
+    python benchmarks/run.py [--calls 400] [--latency 0.002] [--error-rate 0]
+                             [--rate-limit-rate 0] [--title-size 40]
+                             [--output results.json] [--compare old.json]
+
+measures serial, pooled (threads), async and batched throughput, p50/p99
+latency of single calls and peak python memory for shorten, expand, link
+metrics and user_link_history paging. results are written as json (to
+stdout, or --output) so runs of different versions can be compared with
+--compare.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(__file__))
+from mockserver import MockServer
+import bitly_api
+
+
+class Latencies(bitly_api.Instrumentation):
+    """keeps the duration of every call"""
+
+    def __init__(self):
+        self.times = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        with self._lock:
+            self.times.append(event.total_time)
+            if event.error is not None:
+                self.errors += 1
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _serial(func, items):
+    for item in items:
+        try:
+            func(item)
+        except bitly_api.BitlyError:
+            pass
+
+
+def _async(method, items, concurrency):
+    import asyncio
+
+    async def run(connection):
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(item):
+            async with limit:
+                try:
+                    await getattr(connection, method)(item)
+                except bitly_api.BitlyError:
+                    pass
+        await asyncio.gather(*[one(item) for item in items])
+        # its connections belong to this event loop
+        connection.close()
+
+    def scenario(connection):
+        asyncio.run(run(connection))
+    return scenario
+
+
+def scenarios(args):
+    """yield (name, connection kwargs, is_async, function of a connection,
+    number of items processed)"""
+    n = args.calls
+    urls = ['http://example.com/%d' % i for i in range(n)]
+    hashes = ['%07x' % i for i in range(n)]
+    links = ['http://bit.ly/' + h for h in hashes]
+    oauth = dict(access_token='mock')
+    workers = args.workers
+
+    yield ('shorten/serial', {}, False,
+           lambda c: _serial(c.shorten, urls), n)
+    yield ('shorten/pooled', {}, False,
+           lambda c: list(c.shorten_many(urls, workers=workers)), n)
+    yield ('expand/serial', {}, False,
+           lambda c: _serial(lambda h: c.expand(hash=h), hashes), n)
+    yield ('expand/batched', {}, False,
+           lambda c: list(c.expand_many(hashes, workers=workers)), n)
+    yield ('expand/coalesced', dict(coalesce_window=0.002), False,
+           lambda c: list(bitly_api.bulk.imap(
+               lambda h: c.expand(hash=h), hashes, workers * 4)), n)
+    yield ('link_clicks/serial', oauth, False,
+           lambda c: _serial(lambda l: c.link_clicks(l, rollup=True), links),
+           n)
+    yield ('link_clicks/pooled', oauth, False,
+           lambda c: list(c.metrics_many('link_clicks', links,
+                                         workers=workers, rollup=True)), n)
+    yield ('link_clicks/arrays', oauth, False,
+           lambda c: _serial(lambda l: c.link_clicks(
+               l, unit='day', units=30, as_arrays=True), links), n)
+    page_size = 100
+    yield ('link_history/pager', oauth, False,
+           lambda c: list(c.iter_user_link_history(page_size=page_size)),
+           args.history)
+    yield ('link_history/fields', oauth, False,
+           lambda c: list(c.iter_user_link_history(
+               page_size=page_size, fields=['link'])), args.history)
+    if sys.version_info >= (3, 7):
+        yield ('shorten/async', {}, True,
+               _async('shorten', urls, workers), n)
+        yield ('expand/async', {}, True,
+               _async('expand', hashes, workers), n)
+
+
+def measure(server, name, kwargs, is_async, func, items, memory):
+    latencies = Latencies()
+    cls = bitly_api.AsyncConnection if is_async else bitly_api.Connection
+    connection = server.connection(cls, instrumentation=latencies,
+                                   pool_size=32, **kwargs)
+    requests_before = sum(server.requests.values())
+    started = time.time()
+    func(connection)
+    elapsed = time.time() - started
+    result = dict(
+        name=name, items=items, seconds=round(elapsed, 4),
+        items_per_sec=round(items / elapsed, 1),
+        calls=len(latencies.times), errors=latencies.errors,
+        requests=sum(server.requests.values()) - requests_before,
+        p50_ms=_ms(percentile(latencies.times, 0.5)),
+        p99_ms=_ms(percentile(latencies.times, 0.99)))
+    connection.close()
+
+    if memory and tracemalloc is not None:
+        # a second run, as tracing allocations slows everything down
+        connection = server.connection(cls, pool_size=32, **kwargs)
+        tracemalloc.start()
+        func(connection)
+        result['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+        connection.close()
+    return result
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def compare(old, new):
+    """print throughput and latency changes between two result documents"""
+    previous = dict((r['name'], r) for r in old['results'])
+    print('%-22s %14s %14s %10s' % ('scenario', 'items/s', 'p99 ms',
+                                    'memory kb'))
+    for r in new['results']:
+        o = previous.get(r['name'])
+        if o is None:
+            continue
+
+        def change(key):
+            if o.get(key) in (None, 0) or r.get(key) is None:
+                return '-'
+            return '%+.0f%%' % ((r[key] - o[key]) * 100.0 / o[key])
+        print('%-22s %14s %14s %10s' % (r['name'], change('items_per_sec'),
+                                        change('p99_ms'),
+                                        change('peak_memory_kb')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=400)
+    parser.add_argument('--history', type=int, default=3000,
+                        help='links in the mock link history')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--jitter', type=float, default=0.001)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--title-size', type=int, default=40)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the peak memory runs')
+    parser.add_argument('--only', help='run scenarios starting with this')
+    parser.add_argument('--output', help='write the json here')
+    parser.add_argument('--compare', help='a previous --output to compare to')
+    args = parser.parse_args(argv)
+
+    server = MockServer(latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate,
+                        title_size=args.title_size,
+                        max_history=args.history).start()
+    results = []
+    try:
+        for name, kwargs, is_async, func, items in scenarios(args):
+            if args.only and not name.startswith(args.only):
+                continue
+            results.append(measure(server, name, kwargs, is_async, func,
+                                   items, not args.no_memory))
+            sys.stderr.write('%(name)-22s %(items_per_sec)10.1f items/s  '
+                             'p50 %(p50_ms)s ms  p99 %(p99_ms)s ms\n'
+                             % results[-1])
+    finally:
+        server.stop()
+
+    document = dict(
+        bitly_api=bitly_api.__version__, python=platform.python_version(),
+        json_backend=bitly_api.fastjson.BACKEND, created=int(time.time()),
+        config=dict((k, v) for k, v in vars(args).items()
+                    if k not in ('output', 'compare', 'only')),
+        results=results)
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), document)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,27 @@
 from __future__ import absolute_import
-from bitly_api.bitly_api import Connection, BitlyError, Error
+import sys
+from bitly_api.bitly_api import (Connection, BitlyError, BitlyTimeoutError,
+                                 Error)
+from bitly_api.cache import LRUCache, SqliteCache, MemcacheCache
+from bitly_api.instrument import HistogramCollector, Instrumentation
+from bitly_api.metrics_sync import (MetricsSync, MemoryMetricsStore,
+                                    SqliteMetricsStore)
+from bitly_api.ratelimit import RateLimiter
+from bitly_api.results import ShortenResult, ExpandResult, LinkHistoryEntry
+from bitly_api.retry import RetryPolicy
+from bitly_api.series import Series
+from bitly_api.transport import RecordingTransport, ReplayTransport
 __version__ = '0.3'
 __author__ = "Jehiah Czebotar <jehiah@gmail.com>"
-__all__ = ["Connection", "BitlyError", "Error"]
+__all__ = ["Connection", "BitlyError", "BitlyTimeoutError", "Error",
+           "LRUCache", "SqliteCache", "MemcacheCache", "MetricsSync",
+           "MemoryMetricsStore", "SqliteMetricsStore", "RateLimiter",
+           "RetryPolicy", "Series", "ShortenResult", "ExpandResult",
+           "LinkHistoryEntry", "HistogramCollector", "Instrumentation",
+           "RecordingTransport", "ReplayTransport"]
+if sys.version_info >= (3, 7):
+    from bitly_api.aio import AsyncConnection
+    __all__ += ["AsyncConnection"]
 __doc__ = """
 This is a python library for the bitly api
 
@@ -0,0 +1,529 @@
+"""
+asyncio support for the bitly api (python 3.7+)
+
+    import bitly_api
+    c = bitly_api.AsyncConnection(access_token='...')
+    data = await c.shorten('http://www.google.com/')
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import ssl
+import sys
+import time
+from collections import deque
+
+from bitly_api.bitly_api import (Connection, BitlyError, BitlyTimeoutError,
+                                 IDEMPOTENT_METHODS, LINK_METRICS,
+                                 MAX_BATCH_SIZE,
+                                 _is_rate_limited, _match_entries,
+                                 _params_key, _remaining, _time_left)
+from bitly_api.bulk import MetricsTotals, chunked
+from bitly_api.instrument import CallEvent
+from bitly_api.pool import CHUNK_SIZE, Decompressor
+
+
+class _PendingCall(Exception):
+    """raised by AsyncConnection._call to hand a request back to the loop"""
+
+    def __init__(self, host, method, params, secret, timeout, decode):
+        Exception.__init__(self, method)
+        self.host = host
+        self.method = method
+        self.params = params
+        self.secret = secret
+        self.timeout = timeout
+        self.decode = decode
+
+
+class AsyncHTTPConnectionPool(object):
+    """
+    a pool of persistent HTTP/1.1 connections to a single host built on
+    asyncio streams. it mirrors bitly_api.pool.HTTPConnectionPool: at most
+    `maxsize` idle connections are kept, idle connections older than
+    `idle_timeout` seconds are discarded, and a reused connection that the
+    server has closed is replaced once. connections belong to the event loop
+    that opened them; idle ones left by another loop are discarded.
+    """
+
+    def __init__(self, host, scheme='http', maxsize=10, idle_timeout=60):
+        assert scheme in ('http', 'https')
+        self.host = host
+        self.scheme = scheme
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        if ':' in host:
+            self._hostname, port = host.rsplit(':', 1)
+            self._port = int(port)
+        else:
+            self._hostname = host
+            self._port = 443 if scheme == 'https' else 80
+        self._idle = deque()
+
+    async def _new_conn(self, connect_timeout=None):
+        ssl_context = None
+        if self.scheme == 'https':
+            ssl_context = ssl.create_default_context()
+        return await asyncio.wait_for(
+            asyncio.open_connection(self._hostname, self._port,
+                                    ssl=ssl_context), connect_timeout)
+
+    async def _get_conn(self, connect_timeout=None):
+        """return ((reader, writer), reused)"""
+        now = time.time()
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            conn, last_used, conn_loop = self._idle.pop()
+            if (conn_loop is loop and now - last_used <= self.idle_timeout
+                    and not conn[0].at_eof()):
+                return conn, True
+            _close_conn(conn, conn_loop)
+        return await self._new_conn(connect_timeout), False
+
+    def _put_conn(self, conn):
+        if len(self._idle) < self.maxsize:
+            self._idle.append((conn, time.time(),
+                               asyncio.get_running_loop()))
+        else:
+            conn[1].close()
+
+    async def urlopen(self, path, headers=None, connect_timeout=None,
+                      read_timeout=None, timings=None):
+        """
+        issue a GET for `path` and return (status, headers, body). header
+        names are lower cased. `connect_timeout` bounds opening a connection
+        and `read_timeout` sending the request and reading the response;
+        asyncio.TimeoutError is raised when either is exceeded. `timings` is
+        filled in like HTTPConnectionPool.urlopen's.
+        """
+        lines = ['GET %s HTTP/1.1' % path, 'Host: %s' % self.host]
+        for name, value in (headers or {}).items():
+            lines.append('%s: %s' % (name, value))
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        started = time.time()
+        conn, reused = await self._get_conn(connect_timeout)
+        connected = time.time()
+        while True:
+            reader, writer = conn
+            phases = {}
+            try:
+                writer.write(request)
+                status, response_headers, body, will_close = \
+                    await asyncio.wait_for(_read_response(reader, phases),
+                                           read_timeout)
+            except asyncio.TimeoutError:
+                writer.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                writer.close()
+                # never send again once the server has started answering
+                if not reused or 'status' in phases:
+                    raise
+                conn, reused = await self._new_conn(connect_timeout), False
+                connected = time.time()
+                continue
+            if timings is not None:
+                timings['connect'] = connected - started
+                timings['ttfb'] = phases['first_byte'] - connected
+                timings['read'] = time.time() - phases['first_byte']
+            if will_close:
+                writer.close()
+            else:
+                self._put_conn(conn)
+            return status, response_headers, body
+
+    def close(self):
+        """close all idle connections"""
+        while self._idle:
+            conn, _, loop = self._idle.pop()
+            _close_conn(conn, loop)
+
+
+def _close_conn(conn, loop):
+    # a closed loop can't run the transport's cleanup any more; its socket
+    # is closed when the transport is garbage collected
+    if not loop.is_closed():
+        conn[1].close()
+
+
+async def _read_response(reader, phases=None):
+    """
+    read one HTTP/1.x response; return (status, headers, body, will_close).
+    the times the status line and the headers were read are stored in
+    phases['status'] and phases['first_byte'].
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ValueError('connection closed by server')
+    if phases is not None:
+        phases['status'] = time.time()
+    version, status = status_line.split(None, 2)[:2]
+    status = int(status)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n'):
+            break
+        if not line:
+            raise ValueError('connection closed while reading headers')
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if phases is not None:
+        phases['first_byte'] = time.time()
+
+    will_close = (version == b'HTTP/1.0' or
+                  headers.get('connection', '').lower() == 'close')
+    decompressor = Decompressor(headers.get('content-encoding'))
+    chunks = []
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(decompressor.decompress(
+                await reader.readexactly(size)))
+            await reader.readline()
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+        while remaining:
+            data = await reader.readexactly(min(remaining, CHUNK_SIZE))
+            remaining -= len(data)
+            chunks.append(decompressor.decompress(data))
+    else:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+        will_close = True
+    chunks.append(decompressor.flush())
+    return status, headers, b''.join(chunks), will_close
+
+
+_DONE = object()
+
+
+async def _amap(func, iterable, workers, ordered=True):
+    """
+    await func(item) for each item of `iterable`, at most `workers` at a
+    time, yielding the results in input order or as they complete. an
+    exception raised by `func` is re-raised and the other calls cancelled.
+    """
+    assert workers > 0
+    iterator = iter(iterable)
+    pending = []
+
+    def fill():
+        while len(pending) < workers:
+            item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            pending.append(asyncio.ensure_future(func(item)))
+
+    try:
+        fill()
+        while pending:
+            if ordered:
+                task = pending.pop(0)
+                await asyncio.wait([task])
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                task = done.pop()
+                pending.remove(task)
+            fill()
+            yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _sync_only(name):
+    def method(self, *args, **kwargs):
+        raise NotImplementedError(
+            "%s is not available on AsyncConnection; use a Connection" % name)
+    method.__name__ = name
+    return method
+
+
+class AsyncConnection(Connection):
+    """
+    a Connection whose api methods are coroutines
+
+    every public endpoint of Connection is available with the same arguments
+    and return values; parameter validation and error handling are shared
+    with Connection, only the transport differs. requests are sent over
+    pooled keep-alive connections so many calls can be in flight at once on
+    one event loop. timeouts() scopes are tracked per task, and single_flight
+    shares in-flight calls between tasks.
+
+    the bulk methods (shorten_many, expand_many, metrics_many...) are async
+    generators, running up to `workers` calls at a time as tasks, to be
+    consumed with `async for`; metrics_totals is a coroutine. the history
+    pagers and export_user_link_history are not available.
+
+    Usage:
+        c = bitly_api.AsyncConnection(access_token='...')
+        results = await asyncio.gather(*[c.expand(hash=h) for h in hashes])
+    """
+
+    _pool_class = AsyncHTTPConnectionPool
+
+    def __init__(self, *args, **kwargs):
+        assert kwargs.get('coalesce_window') is None, \
+            "AsyncConnection does not support coalesce_window"
+        assert kwargs.get('transport') is None, \
+            "AsyncConnection does not support transport"
+        Connection.__init__(self, *args, **kwargs)
+        self._replay = None
+        self._timeout_scope = contextvars.ContextVar('timeouts', default=None)
+        # single flight calls in progress, by key
+        self._flights = {}
+
+    def _get_timeout_scope(self):
+        return self._timeout_scope.get()
+
+    def _set_timeout_scope(self, scope):
+        self._timeout_scope.set(scope)
+
+    def _call(self, host, method, params, secret=None, timeout=None,
+              decode=None):
+        # endpoint methods are run twice by _coroutine_method: first to
+        # capture the request, then again with the fetched response so that
+        # Connection's own unpacking of the result is reused.
+        if self._replay is None:
+            raise _PendingCall(host, method, params, secret, timeout,
+                               decode)
+        data, self._replay = self._replay, None
+        return data
+
+    async def _fetch(self, host, method, params, secret=None, timeout=None,
+                     decode=None):
+        if self.instrumentation is None:
+            return await self._dispatch(host, method, params, secret,
+                                        timeout, decode)
+        event = CallEvent(method)
+        started = time.time()
+        try:
+            data = await self._dispatch(host, method, params, secret,
+                                        timeout, decode, event)
+            event.status = event.status or 200
+            return data
+        except BitlyError as e:
+            event.status = e.code
+            event.error = e
+            raise
+        finally:
+            event.total_time = time.time() - started
+            self.instrumentation.record(event)
+
+    async def _dispatch(self, host, method, params, secret, timeout, decode,
+                        event=None):
+        cache_key = None
+        if decode is None:
+            cache_key = self._cache_key(method, params)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if event is not None:
+                event.cache = 'miss' if cached is None else 'hit'
+            if cached is not None:
+                return self.json_decoder(cached)
+        if self._single_flight is not None and method in IDEMPOTENT_METHODS:
+            key = (host, decode, _params_key(method, params))
+            task = self._flights.get(key)
+            if task is None:
+                # run the call as its own task so that cancelling the caller
+                # that started it doesn't cancel it for everyone else
+                task = asyncio.ensure_future(self._call_api(
+                    host, method, params, secret, timeout, cache_key,
+                    decode, event))
+                self._flights[key] = task
+                task.add_done_callback(
+                    lambda task: self._flights.pop(key, None))
+            return await asyncio.shield(task)
+        return await self._call_api(host, method, params, secret, timeout,
+                                    cache_key, decode, event)
+
+    async def _call_api(self, host, method, params, secret, timeout,
+                        cache_key, decode=None, event=None):
+        timeouts = self._effective_timeouts(timeout)
+        scheme, host, path = self._build_request(host, method, params, secret)
+        data = await self._send_retrying(method, scheme, host, path, timeouts,
+                                         decode, event)
+        if cache_key is not None:
+            self.cache.set(cache_key, json.dumps(data),
+                           self._cache_ttl(method, data))
+        return data
+
+    async def _send_retrying(self, method, scheme, host, path, timeouts,
+                             decode=None, event=None):
+        policy = self.retry_policy
+        if not policy or method not in IDEMPOTENT_METHODS:
+            return await self._send(method, scheme, host, path, timeouts,
+                                    decode, event)
+        started = policy.start()
+        deadline = timeouts[2]
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self._send(method, scheme, host, path, timeouts,
+                                        decode, event)
+            except BitlyError as e:
+                delay = policy.delay(attempt, started, e)
+                if delay is None:
+                    raise
+                if deadline is not None and time.time() + delay > deadline:
+                    raise
+            await asyncio.sleep(delay)
+
+    async def _send(self, method, scheme, host, path, timeouts, decode=None,
+                    event=None):
+        limiter = self._get_rate_limiter(method)
+        if limiter is None:
+            return await self._request(scheme, host, path, timeouts, decode,
+                                       event)
+        queued = time.time()
+        while True:
+            delay = limiter.try_acquire()
+            if delay == 0:
+                break
+            delay = 0.005 if delay is None else delay
+            remaining = _time_left(timeouts[2])
+            if remaining is not None:
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+        if event is not None:
+            event.queue_time += time.time() - queued
+        rate_limited = False
+        try:
+            return await self._request(scheme, host, path, timeouts, decode,
+                                       event)
+        except BitlyError as e:
+            rate_limited = _is_rate_limited(e)
+            raise
+        finally:
+            limiter.release(rate_limited)
+
+    async def shorten_many(self, uris, workers=4, ordered=True,
+                           max_pending=None, preferred_domain=None):
+        """ like Connection.shorten_many(), as an async generator. no more
+        than `workers` urls are read ahead; max_pending is ignored """
+        async def shorten(uri):
+            try:
+                return await self.shorten(uri,
+                                          preferred_domain=preferred_domain)
+            except BitlyError as e:
+                return e
+        async for result in _amap(shorten, uris, workers, ordered):
+            yield result
+
+    async def metrics_many(self, endpoint, links, workers=4, ordered=False,
+                           max_pending=None, **metric_kwargs):
+        """ like Connection.metrics_many(), as an async generator. no more
+        than `workers` links are read ahead; max_pending is ignored """
+        assert endpoint in LINK_METRICS, "unsupported endpoint %r" % endpoint
+        method = getattr(self, endpoint)
+
+        async def call(link):
+            try:
+                return link, await method(link, **metric_kwargs)
+            except BitlyError as e:
+                return link, e
+        async for pair in _amap(call, links, workers, ordered):
+            yield pair
+
+    async def metrics_totals(self, endpoint, links, key=None, value='clicks',
+                             workers=4, **metric_kwargs):
+        """ like Connection.metrics_totals() """
+        totals = MetricsTotals(key, value)
+        async for link, result in self.metrics_many(endpoint, links, workers,
+                                                    **metric_kwargs):
+            totals.add(link, result)
+        return totals.totals, totals.errors
+
+    async def _batch_lookup(self, method, links, chunk_size, workers):
+        # expand_many, info_many and clicks*_many return this generator
+        assert 0 < chunk_size <= MAX_BATCH_SIZE, \
+            "chunk_size must be between 1 and %d" % MAX_BATCH_SIZE
+        lookup = functools.partial(self._lookup_links, method)
+        async for results in _amap(lookup, chunked(links, chunk_size),
+                                   workers):
+            for result in results:
+                yield result
+
+    async def _lookup_links(self, method, links):
+        hashes = [link for link in links if '/' not in link]
+        short_urls = [link for link in links if '/' in link]
+        entries = await method(hash=hashes or None,
+                               shortUrl=short_urls or None)
+        return _match_entries(links, entries)
+
+    iter_user_link_history = _sync_only('iter_user_link_history')
+    iter_user_network_history = _sync_only('iter_user_network_history')
+    export_user_link_history = _sync_only('export_user_link_history')
+
+    async def _request(self, scheme, host, path, timeouts, decode=None,
+                       event=None):
+        connect_timeout, read_timeout = _remaining(timeouts)
+        try:
+            pool = self._get_pool(scheme, host)
+            if event is None:
+                status, headers, body = await pool.urlopen(
+                    path, self._headers(' asyncio'), connect_timeout,
+                    read_timeout)
+                return self._parse_response(status, body,
+                                            decode or self.json_decoder)
+            event.attempts += 1
+            timings = {}
+            status, headers, body = await pool.urlopen(
+                path, self._headers(' asyncio'), connect_timeout,
+                read_timeout, timings)
+            return self._parse_timed(event, timings, status, body,
+                                     decode or self.json_decoder)
+        except asyncio.TimeoutError:
+            raise BitlyTimeoutError('TIMEOUT')
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise BitlyError(500, str(e), transient=True)
+        except BitlyError:
+            raise
+        except Exception:
+            raise BitlyError(None, sys.exc_info()[1], transient=True)
+
+
+def _coroutine_method(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except _PendingCall as call:
+            data = await self._fetch(call.host, call.method, call.params,
+                                     call.secret, call.timeout, call.decode)
+        # no await between setting and consuming _replay, so concurrent
+        # coroutines on the same loop can't observe each other's response
+        self._replay = data
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._replay = None
+    return wrapper
+
+
+# methods of Connection that are not single api calls
+_NOT_ENDPOINTS = frozenset([
+    'close', 'timeouts', 'shorten_many', 'expand_many', 'info_many',
+    'clicks_many', 'clicks_by_day_many', 'clicks_by_minute_many',
+    'iter_user_link_history', 'iter_user_network_history',
+    'export_user_link_history', 'metrics_many', 'metrics_totals'])
+
+for _name, _method in list(vars(Connection).items()):
+    if (_name.startswith('_') or _name in _NOT_ENDPOINTS or
+            not callable(_method)):
+        continue
+    setattr(AsyncConnection, _name, _coroutine_method(_method))
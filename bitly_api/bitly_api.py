@@ -1,21 +1,34 @@
+from __future__ import absolute_import
+
+import contextlib
+import functools
 import hashlib
 import json
+import socket
 import sys
+import threading
 import time
-import types
 import warnings
 
+from bitly_api.bulk import (chunked, imap, sum_metrics, Coalescer,
+                            CoalesceTimeout, SingleFlight)
+from bitly_api.fastjson import loads, select_fields
+from bitly_api.history import (LinkHistoryPager, NetworkHistoryPager,
+                               export_link_history, CSV_FIELDS)
+from bitly_api.instrument import CallEvent
+from bitly_api.pool import HTTPConnectionPool, httplib
+from bitly_api.results import ShortenResult, ExpandResult, LinkHistoryEntry
+from bitly_api.retry import RetryPolicy
+from bitly_api.series import decode_buckets, find_buckets, to_series
+
 try:
-    from urllib.request import build_opener, HTTPRedirectHandler
     from urllib.parse import urlencode
-    from urllib.error import URLError, HTTPError
     string_types = str,
     integer_types = int,
     numeric_types = (int, float)
     text_type = str
     binary_type = bytes
 except ImportError as e:
-    from urllib2 import build_opener, HTTPRedirectHandler, URLError, HTTPError
     from urllib import urlencode
     string_types = basestring,
     integer_types = (int, long)
@@ -24,20 +37,89 @@ except ImportError as e:
     binary_type = str
 
 
-class DontRedirect(HTTPRedirectHandler):
-    def redirect_response(self, req, fp, code, msg, headers, newurl):
-        if code in (301, 302, 303, 307):
-            raise HTTPError(req.get_full_url(), code, msg, headers, fp)
-
-
 class Error(Exception):
     pass
 
 
 class BitlyError(Error):
-    def __init__(self, code, message):
+    def __init__(self, code, message, transient=False):
         Error.__init__(self, message)
         self.code = code
+        # a failure that may succeed if the call is retried
+        self.transient = transient
+
+
+class BitlyTimeoutError(BitlyError):
+    """a call did not complete within its timeout or deadline"""
+
+    def __init__(self, message):
+        BitlyError.__init__(self, 504, message, transient=True)
+
+
+# read only api methods, which are safe to retry
+IDEMPOTENT_METHODS = frozenset([
+    'v3/expand', 'v3/info', 'v3/clicks', 'v3/referrers', 'v3/clicks_by_day',
+    'v3/clicks_by_minute', 'v3/lookup', 'v3/bitly_pro_domain', 'v3/highvalue',
+    'v3/search',
+    'v3/link/clicks', 'v3/link/encoders', 'v3/link/encoders_count',
+    'v3/link/referring_domains', 'v3/link/referrers_by_domain',
+    'v3/link/referrers', 'v3/link/shares', 'v3/link/countries',
+    'v3/link/lookup', 'v3/link/info', 'v3/link/content', 'v3/link/category',
+    'v3/link/social', 'v3/link/location', 'v3/link/language',
+    'v3/user/clicks', 'v3/user/countries', 'v3/user/popular_links',
+    'v3/user/referrers', 'v3/user/referring_domains', 'v3/user/share_counts',
+    'v3/user/share_counts_by_share_type', 'v3/user/shorten_counts',
+    'v3/user/tracking_domain_list', 'v3/user/tracking_domain_clicks',
+    'v3/user/tracking_domain_shorten_counts', 'v3/user/link_history',
+    'v3/user/network_history', 'v3/user/link_lookup',
+    'v3/user/bundle_history',
+    'v3/bundle/bundles_by_user', 'v3/bundle/contents',
+    'v3/bundle/view_count',
+    'v3/realtime/bursting_phrases', 'v3/realtime/hot_phrases',
+    'v3/realtime/clickrate',
+])
+
+# how many seconds responses of cacheable api methods stay fresh (None: as
+# long as the cache keeps them). short links never change their target, and
+# shortening a url again returns the same link for the same user, but page
+# titles in info do change.
+DEFAULT_CACHE_TTLS = {
+    'v3/expand': None,
+    'v3/shorten': None,
+    'v3/info': 300,
+    'v3/link/lookup': 3600,
+    'v3/lookup': 3600,
+}
+
+# seconds to cache a response holding per-link errors (ie: a NOT_FOUND
+# hash, which may be created later)
+NEGATIVE_CACHE_TTL = 60
+
+# cacheable methods whose response depends on the calling user
+_USER_CACHE_METHODS = frozenset(['v3/shorten'])
+
+# call parameters left out of cache keys
+_SECRET_PARAMS = frozenset(['x_apiKey', 'apiKey', 'access_token',
+                            'signature'])
+
+# the most hashes / short urls the api accepts in one expand, info or clicks
+# request
+MAX_BATCH_SIZE = 15
+
+# parameters _build_request adds to every call
+_STATIC_PARAMS = frozenset(['format', 'access_token', 'login', 'apiKey'])
+
+# single link metrics methods that metrics_many() can fan out
+LINK_METRICS = frozenset([
+    'link_clicks', 'link_countries', 'link_referrers',
+    'link_referring_domains', 'link_referrers_by_domain', 'link_shares'])
+
+
+def _link_fields(fields):
+    """the decoder selecting `fields` of expand and info results"""
+    if fields is None:
+        return None
+    return select_fields(fields, ('hash', 'short_url'))
 
 
 def _utf8(s):
@@ -47,6 +129,27 @@ def _utf8(s):
     return s
 
 
+def _signature_bytes(value):
+    if isinstance(value, numeric_types):
+        value = str(value)
+    return _utf8(value)
+
+
+_last_timestamp = (None, None)
+
+
+def _signature_timestamp():
+    """the 't' parameter of a signed call, computed at most once a second"""
+    global _last_timestamp
+    now = int(time.time())
+    second, timestamp = _last_timestamp
+    if second != now:
+        # note, this uses a utc timestamp not a local timestamp
+        timestamp = str(int(time.mktime(time.gmtime(now))))
+        _last_timestamp = (now, timestamp)
+    return timestamp
+
+
 def _utf8_params(params):
     """encode a dictionary of URL parameters (including iterables) as utf-8"""
     assert isinstance(params, dict)
@@ -64,6 +167,100 @@ def _utf8_params(params):
     return dict(encoded_params)
 
 
+def _params_key(method, params):
+    """a string identifying a call by its method and (unsigned) params"""
+    params = sorted(_utf8_params(params).items())
+    return "%s?%s" % (method, urlencode(params, doseq=1))
+
+
+def _remaining(timeouts):
+    """
+    the (connect, read) timeouts to use for a request given its
+    (connect, read, deadline) timeouts; raises BitlyTimeoutError once the
+    deadline has passed
+    """
+    connect, read, deadline = timeouts
+    remaining = _time_left(deadline)
+    if remaining is None:
+        return connect, read
+    return min(connect or remaining, remaining), min(read or remaining,
+                                                     remaining)
+
+
+def _time_left(deadline):
+    """
+    seconds until `deadline` (None: no deadline); raises BitlyTimeoutError
+    once it has passed
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise BitlyTimeoutError('DEADLINE_EXCEEDED')
+    return remaining
+
+
+def _is_rate_limited(error):
+    """is this BitlyError the api asking us to slow down"""
+    return error.code == 429 or (error.code == 403 and
+                                 'RATE_LIMIT_EXCEEDED' in str(error))
+
+
+def _single_link(hash, shortUrl):
+    """return the link if a single hash or short url string was given"""
+    if hash and shortUrl:
+        return None
+    link = hash or shortUrl
+    if isinstance(link, string_types):
+        return link
+    return None
+
+
+def _has_entry_errors(data):
+    """whether a multi-link response has an 'error' entry"""
+    data = data.get('data')
+    if not isinstance(data, dict):
+        return False
+    for value in data.values():
+        if isinstance(value, list):
+            for entry in value:
+                if isinstance(entry, dict) and 'error' in entry:
+                    return True
+    return False
+
+
+def _match_entries(links, entries):
+    """
+    order the per-link entries of a multi-link response like `links`.
+    entries are matched on their 'short_url' or 'hash' key, anything left
+    over is assigned positionally.
+    """
+    positions = {}
+    for i, link in enumerate(links):
+        key = ('short_url' if '/' in link else 'hash', link)
+        positions.setdefault(key, []).append(i)
+
+    results = [None] * len(links)
+    unmatched = []
+    for entry in entries:
+        for key in ('short_url', 'hash'):
+            indexes = positions.get((key, entry.get(key)))
+            if indexes:
+                results[indexes.pop(0)] = entry
+                break
+        else:
+            unmatched.append(entry)
+
+    for i, link in enumerate(links):
+        if results[i] is None:
+            if unmatched:
+                results[i] = unmatched.pop(0)
+            else:
+                key = 'short_url' if '/' in link else 'hash'
+                results[i] = {key: link, 'error': 'MISSING_RESULT'}
+    return results
+
+
 class Connection(object):
     """
     This is a python library for accessing the bitly api
@@ -75,20 +272,174 @@ class Connection(object):
         # or to use oauth2 endpoints
         c = bitly_api.Connection(access_token='...')
         c.shorten('http://www.google.com/')
+
+    requests are sent over persistent HTTP/1.1 connections; `pool_size` is
+    the number of idle connections kept per host and `pool_idle_timeout` the
+    number of seconds an idle connection may be reused for.
+
+    `rate_limits` maps api method prefixes to shared RateLimiter instances;
+    each call is throttled by the longest matching prefix, ie:
+        rate_limits={'v3/shorten': RateLimiter(rate=5),
+                     'v3/link/': RateLimiter(rate=20, max_concurrency=4),
+                     '': RateLimiter(rate=50)}
+
+    `connect_timeout` and `read_timeout` (in seconds) bound opening a
+    connection and each socket read; `deadline` bounds each call including
+    its retries. use the timeouts() context manager to override them for a
+    block of calls. calls that run out of time raise BitlyTimeoutError.
+
+    calls to IDEMPOTENT_METHODS that fail transiently (network errors, 5xx
+    responses, malformed bodies) are retried according to `retry_policy`;
+    pass retry_policy=False to disable retries.
+
+    `cache` (a bitly_api.cache.CacheBackend such as LRUCache, SqliteCache or
+    MemcacheCache) enables caching of successful responses for the api
+    methods in `cache_ttls`, keyed by method and parameters (and user, for
+    shorten). responses with per-link errors are cached for at most
+    NEGATIVE_CACHE_TTL seconds.
+
+    with `single_flight` set, concurrent identical calls to
+    IDEMPOTENT_METHODS share one request and receive the same result object.
+
+    response bodies are parsed straight from bytes by `json_decoder`, a
+    function of a bytes (or for cached responses, text) json document
+    (default: bitly_api.fastjson.loads, which uses orjson or ujson when
+    installed).
+
+    responses are requested gzip or deflate compressed and decompressed as
+    they are read; pass compress=False to ask for them uncompressed.
+
+    `instrumentation` (see bitly_api.instrument, ie: a HistogramCollector)
+    is handed a CallEvent with the timings, size, status and cache outcome
+    of every call.
+
+    with `typed_results` set, shorten(), expand() and user_link_history()
+    return compact ShortenResult, ExpandResult and LinkHistoryEntry objects
+    (see bitly_api.results) which support the same dict style access.
+
+    `transport` (see bitly_api.transport) replaces the network below the
+    connection pools, ie: to record calls with a RecordingTransport or answer
+    them from a recording with a ReplayTransport.
+
+    setting `coalesce_window` (in seconds) makes concurrent single-link
+    expand() and info() calls from different threads wait up to that long to
+    be sent together in one request of at most `coalesce_max` links.
     """
 
+    _pool_class = HTTPConnectionPool
+
     def __init__(self, login=None, api_key=None, access_token=None,
-                 secret=None):
+                 secret=None, pool_size=10, pool_idle_timeout=60,
+                 coalesce_window=None, coalesce_max=MAX_BATCH_SIZE,
+                 rate_limits=None, retry_policy=None, connect_timeout=5,
+                 read_timeout=10, deadline=None, cache=None,
+                 cache_ttls=None, single_flight=False, json_decoder=None,
+                 typed_results=False, compress=True, instrumentation=None,
+                 transport=None):
         self.host = 'api.bit.ly'
         self.ssl_host = 'api-ssl.bit.ly'
         self.login = login
         self.api_key = api_key
         self.access_token = access_token
         self.secret = secret
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.rate_limits = rate_limits or {}
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self._local = threading.local()
+        self.cache = cache
+        if cache_ttls is None:
+            cache_ttls = DEFAULT_CACHE_TTLS
+        self.cache_ttls = cache_ttls
+        self._single_flight = SingleFlight() if single_flight else None
+        self.json_decoder = json_decoder or loads
+        self.typed_results = typed_results
+        self.compress = compress
+        self.instrumentation = instrumentation
+        self.transport = transport
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._path_prefixes = {}
+        self._coalescers = {}
+        if coalesce_window is not None:
+            assert 0 < coalesce_max <= MAX_BATCH_SIZE
+            for method in (self.expand, self.info):
+                lookup = functools.partial(self._lookup_links, method)
+                self._coalescers[method.__name__] = Coalescer(
+                    lookup, coalesce_window, coalesce_max)
         (major, minor, micro, releaselevel, serial) = sys.version_info
         parts = (major, minor, micro, '?')
         self.user_agent = "Python/%d.%d.%d bitly_api/%s" % parts
 
+    @contextlib.contextmanager
+    def timeouts(self, connect=None, read=None, deadline=None):
+        """
+        override the connect and read timeouts for calls made in this block
+        (in this thread), and optionally give the whole block a `deadline` in
+        seconds. bulk methods consumed inside the block apply it to their
+        worker threads too.
+
+            with c.timeouts(read=2, deadline=30):
+                results = list(c.expand_many(hashes))
+        """
+        previous = self._get_timeout_scope()
+        scope = self._effective_timeouts()
+        if deadline is not None:
+            deadline = time.time() + deadline
+            if scope[2] is not None:
+                deadline = min(deadline, scope[2])
+        self._set_timeout_scope((connect or scope[0], read or scope[1],
+                                 deadline or scope[2]))
+        try:
+            yield
+        finally:
+            self._set_timeout_scope(previous)
+
+    def _get_timeout_scope(self):
+        return getattr(self._local, 'timeouts', None)
+
+    def _set_timeout_scope(self, scope):
+        self._local.timeouts = scope
+
+    def _effective_timeouts(self, timeout=None):
+        """
+        return (connect_timeout, read_timeout, deadline) for a call; the
+        deadline is an absolute time.time() value or None
+        """
+        scope = self._get_timeout_scope()
+        if scope is None:
+            scope = (self.connect_timeout, self.read_timeout, None)
+        connect, read, deadline = scope
+        if timeout is not None:
+            # _call's timeout is in milliseconds
+            read = timeout / 1000.0
+        if self.deadline is not None:
+            call_deadline = time.time() + self.deadline
+            if deadline is None or call_deadline < deadline:
+                deadline = call_deadline
+        return connect, read, deadline
+
+    def _in_timeout_scope(self, func):
+        """wrap func to run under the calling thread's timeouts() scope"""
+        scope = self._get_timeout_scope()
+
+        def wrapper(*args, **kwargs):
+            self._set_timeout_scope(scope)
+            return func(*args, **kwargs)
+        return wrapper
+
+    def close(self):
+        """close all pooled connections"""
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
     def shorten(self, uri, x_login=None, x_apiKey=None, preferred_domain=None):
         """ creates a bitly link for a given long url
         @parameter uri: long url to shorten
@@ -104,26 +455,60 @@ class Connection(object):
                 'x_login': x_login,
                 'x_apiKey': x_apiKey})
         data = self._call(self.host, 'v3/shorten', params, self.secret)
+        if self.typed_results:
+            return ShortenResult(data['data'])
         return data['data']
 
-    def expand(self, hash=None, shortUrl=None, link=None):
+    def shorten_many(self, uris, workers=4, ordered=True, max_pending=None,
+                     preferred_domain=None):
+        """ shorten any number of long urls concurrently
+        @parameter uris: iterable of long urls; it is consumed lazily
+        @parameter workers: number of shorten requests to run concurrently
+        @parameter ordered: yield results in input order (default) or as
+            they complete
+        @parameter max_pending: most urls read ahead of the consumer
+            (default 2 * workers)
+        @parameter preferred_domain: bit.ly[default], bitly.com, or j.mp
+        yields the shorten() result for each url, or the BitlyError raised
+        for it. for full connection reuse keep pool_size >= workers.
+        """
+        def shorten(uri):
+            return self.shorten(uri, preferred_domain=preferred_domain)
+        shorten = self._in_timeout_scope(shorten)
+        for result in imap(shorten, uris, workers, ordered=ordered,
+                           max_pending=max_pending, return_exceptions=True):
+            if (isinstance(result, Exception) and
+                    not isinstance(result, BitlyError)):
+                raise result
+            yield result
+
+    def expand(self, hash=None, shortUrl=None, link=None, fields=None):
         """ given a bitly url or hash, decode it and return the target url
         @parameter hash: one or more bitly hashes
         @parameter shortUrl: one or more bitly short urls
         @parameter link: one or more bitly short urls (preferred vocabulary)
+        @parameter fields: only parse these fields of each result (ie:
+            ['long_url']); hash, short_url and error are always kept
         """
         if link and not shortUrl:
             shortUrl = link
 
         if not hash and not shortUrl:
             raise BitlyError(500, 'MISSING_ARG_SHORTURL')
+        if 'expand' in self._coalescers and fields is None:
+            link = _single_link(hash, shortUrl)
+            if link is not None:
+                return [self._coalesced('expand', link)]
         params = dict()
         if hash:
             params['hash'] = hash
         if shortUrl:
             params['shortUrl'] = shortUrl
 
-        data = self._call(self.host, 'v3/expand', params, self.secret)
+        data = self._call(self.host, 'v3/expand', params, self.secret,
+                          decode=_link_fields(fields))
+        if self.typed_results:
+            return [ExpandResult(entry) for entry in data['data']['expand']]
         return data['data']['expand']
 
     def clicks(self, hash=None, shortUrl=None):
@@ -196,8 +581,14 @@ class Connection(object):
                           self.secret)
         return data['data']['clicks_by_minute']
 
-    def link_clicks(self, link, **kwargs):
+    def link_clicks(self, link, as_arrays=False, **kwargs):
+        """
+        clicks on a bitly link. with as_arrays=True returns a Series of
+        parallel timestamp and click count arrays instead of a list of dicts
+        """
         params = dict(link=link)
+        if as_arrays:
+            return self._metrics_series("v3/link/clicks", params, kwargs)
         data = self._call_oauth2_metrics("v3/link/clicks", params, **kwargs)
         return data["link_clicks"]
 
@@ -252,8 +643,54 @@ class Connection(object):
         data = self._call_oauth2_metrics("v3/link/countries", params, **kwargs)
         return data["countries"]
 
-    def user_clicks(self, **kwargs):
-        """aggregate number of clicks on all of this user's bitly links"""
+    def metrics_many(self, endpoint, links, workers=4, ordered=False,
+                     max_pending=None, **metric_kwargs):
+        """ call a single link metrics method for any number of links
+        concurrently
+        @parameter endpoint: the method to call (ie: link_countries)
+        @parameter links: iterable of bitly links; it is consumed lazily
+        @parameter workers: number of requests to run concurrently
+        @parameter ordered: yield results in input order, or as they
+            complete (default)
+        @parameter max_pending: most links read ahead of the consumer
+            (default 2 * workers)
+        any other keyword arguments (unit, units, rollup...) are passed to
+        every call. yields (link, result) pairs, result being the BitlyError
+        raised for a link that failed. calls go through the connection's
+        rate_limits like any other.
+        """
+        assert endpoint in LINK_METRICS, "unsupported endpoint %r" % endpoint
+        method = getattr(self, endpoint)
+
+        def call(link):
+            try:
+                return link, method(link, **metric_kwargs)
+            except BitlyError as e:
+                return link, e
+        call = self._in_timeout_scope(call)
+        return imap(call, links, workers, ordered=ordered,
+                    max_pending=max_pending)
+
+    def metrics_totals(self, endpoint, links, key=None, value='clicks',
+                       workers=4, **metric_kwargs):
+        """ sum a single link metric over many links, in one pass
+        @parameter key: the field to group list results by (ie: country for
+            link_countries, domain for link_referring_domains)
+        @parameter value: the field to sum (default: clicks)
+        other arguments are as for metrics_many(). returns (totals, errors):
+        a dict of sums by key (or one sum without a key) and a dict of the
+        BitlyError raised for each failed link.
+        """
+        return sum_metrics(self.metrics_many(endpoint, links, workers,
+                                             **metric_kwargs), key, value)
+
+    def user_clicks(self, as_arrays=False, **kwargs):
+        """
+        aggregate number of clicks on all of this user's bitly links. with
+        as_arrays=True returns a Series of timestamp and click count arrays
+        """
+        if as_arrays:
+            return self._metrics_series('v3/user/clicks', dict(), kwargs)
         data = self._call_oauth2_metrics('v3/user/clicks', dict(), **kwargs)
         return data
 
@@ -302,7 +739,14 @@ class Connection(object):
                                          dict(), **kwargs)
         return data["share_counts_by_share_type"]
 
-    def user_shorten_counts(self, **kwargs):
+    def user_shorten_counts(self, as_arrays=False, **kwargs):
+        """
+        number of links shortened by the authed user. with as_arrays=True
+        returns a Series of timestamp and shorten count arrays
+        """
+        if as_arrays:
+            return self._metrics_series("v3/user/shorten_counts", dict(),
+                                        kwargs)
         data = self._call_oauth2_metrics("v3/user/shorten_counts", dict(),
                                          **kwargs)
         return data["user_shorten_counts"]
@@ -311,8 +755,15 @@ class Connection(object):
         data = self._call_oauth2("v3/user/tracking_domain_list", dict())
         return data["tracking_domains"]
 
-    def user_tracking_domain_clicks(self, domain, **kwargs):
+    def user_tracking_domain_clicks(self, domain, as_arrays=False, **kwargs):
+        """
+        clicks on links under a tracking domain. with as_arrays=True returns
+        a Series of timestamp and click count arrays
+        """
         params = dict(domain=domain)
+        if as_arrays:
+            return self._metrics_series("v3/user/tracking_domain_clicks",
+                                        params, kwargs)
         data = self._call_oauth2_metrics("v3/user/tracking_domain_clicks",
                                          params, **kwargs)
         return data["tracking_domain_clicks"]
@@ -330,23 +781,28 @@ class Connection(object):
 
     def user_link_history(self, created_before=None, created_after=None,
                           archived=None, limit=None, offset=None,
-                          private=None):
+                          private=None, fields=None):
+        """
+        a page of the authed user's links, newest first. `fields` limits the
+        keys parsed for each link (ie: ['link', 'created_at']; 'link' is
+        always kept), which saves memory and time on large pages.
+        """
         params = dict()
         if created_before is not None:
-            assert isinstance(limit, integer_types)
+            assert isinstance(created_before, integer_types)
             params["created_before"] = created_before
         if created_after is not None:
-            assert isinstance(limit, integer_types)
+            assert isinstance(created_after, integer_types)
             params["created_after"] = created_after
         if archived is not None:
             assert isinstance(archived, string_types)
             archived = archived.lower()
-            assert archived is "on" or "off" or "both"
+            assert archived in ("on", "off", "both")
             params["archived"] = archived
         if private is not None:
             assert isinstance(private, string_types)
             private = private.lower()
-            assert private is "on" or "off" or "both"
+            assert private in ("on", "off", "both")
             params["private"] = private
         if limit is not None:
             assert isinstance(limit, integer_types)
@@ -354,7 +810,12 @@ class Connection(object):
         if offset is not None:
             assert isinstance(offset, integer_types)
             params["offset"] = str(offset)
-        data = self._call_oauth2("v3/user/link_history", params)
+        decode = None
+        if fields is not None:
+            decode = select_fields(fields, ('link',))
+        data = self._call_oauth2("v3/user/link_history", params, decode)
+        if self.typed_results:
+            return [LinkHistoryEntry(link) for link in data["link_history"]]
         return data["link_history"]
 
     def user_network_history(self, offset=None, expand_client_id=False,
@@ -373,22 +834,133 @@ class Connection(object):
         data = self._call_oauth2("v3/user/network_history", params)
         return data
 
-    def info(self, hash=None, shortUrl=None, link=None):
-        """ return the page title for a given bitly link """
+    def iter_user_link_history(self, created_before=None, created_after=None,
+                               archived=None, private=None, page_size=100,
+                               prefetch=True, checkpoint=None, fields=None):
+        """
+        iterate over every link in the user's history, newest first, paging
+        automatically. returns a LinkHistoryPager; see bitly_api.history.
+        @parameter page_size: number of links requested per page (at most
+            100)
+        @parameter prefetch: fetch the next page while this one is consumed
+        @parameter checkpoint: resume from a pager's checkpoint()
+        @parameter fields: only parse these fields of each link
+        """
+        return LinkHistoryPager(self, created_before=created_before,
+                                created_after=created_after,
+                                archived=archived, private=private,
+                                page_size=page_size, prefetch=prefetch,
+                                checkpoint=checkpoint, fields=fields)
+
+    def export_user_link_history(self, out, format='ndjson',
+                                 created_after=None, created_before=None,
+                                 archived=None, private=None, shards=16,
+                                 workers=4, page_size=100, fields=CSV_FIELDS):
+        """
+        write the user's whole link history to the file object `out` as
+        newline delimited json or csv, fetching time windows concurrently.
+        returns the number of links written; see
+        bitly_api.history.export_link_history.
+        """
+        return export_link_history(
+            self, out, format=format, created_after=created_after,
+            created_before=created_before, archived=archived,
+            private=private, shards=shards, workers=workers,
+            page_size=page_size, fields=fields)
+
+    def iter_user_network_history(self, expand_client_id=False,
+                                  expand_user=False, page_size=30,
+                                  prefetch=True, checkpoint=None):
+        """
+        iterate over every entry of the user's network history, paging
+        automatically. returns a NetworkHistoryPager; see bitly_api.history.
+        """
+        return NetworkHistoryPager(self, expand_client_id=expand_client_id,
+                                   expand_user=expand_user,
+                                   page_size=page_size, prefetch=prefetch,
+                                   checkpoint=checkpoint)
+
+    def info(self, hash=None, shortUrl=None, link=None, fields=None):
+        """ return the page title for a given bitly link
+        @parameter fields: only parse these fields of each result (ie:
+            ['title']); hash, short_url and error are always kept
+        """
         if link and not shortUrl:
             shortUrl = link
 
         if not hash and not shortUrl:
             raise BitlyError(500, 'MISSING_ARG_SHORTURL')
+        if 'info' in self._coalescers and fields is None:
+            link = _single_link(hash, shortUrl)
+            if link is not None:
+                return [self._coalesced('info', link)]
         params = dict()
         if hash:
             params['hash'] = hash
         if shortUrl:
             params['shortUrl'] = shortUrl
 
-        data = self._call(self.host, 'v3/info', params, self.secret)
+        data = self._call(self.host, 'v3/info', params, self.secret,
+                          decode=_link_fields(fields))
         return data['data']['info']
 
+    def expand_many(self, links, chunk_size=MAX_BATCH_SIZE, workers=4):
+        """ expand any number of bitly hashes and/or short urls
+        @parameter links: iterable of hashes or short urls
+        @parameter chunk_size: number of links sent per request
+        @parameter workers: number of requests to run concurrently
+        yields one result per link in input order. links the api can't
+        resolve are yielded with an 'error' key (ie: NOT_FOUND).
+        """
+        return self._batch_lookup(self.expand, links, chunk_size, workers)
+
+    def info_many(self, links, chunk_size=MAX_BATCH_SIZE, workers=4):
+        """ like expand_many(), but returns the info for each link """
+        return self._batch_lookup(self.info, links, chunk_size, workers)
+
+    def clicks_many(self, links, chunk_size=MAX_BATCH_SIZE, workers=4):
+        """ like expand_many(), but returns the clicks for each link """
+        return self._batch_lookup(self.clicks, links, chunk_size, workers)
+
+    def clicks_by_day_many(self, links, chunk_size=MAX_BATCH_SIZE,
+                           workers=4):
+        """ like expand_many(), but returns the clicks_by_day for each link
+        """
+        return self._batch_lookup(self.clicks_by_day, links, chunk_size,
+                                  workers)
+
+    def clicks_by_minute_many(self, links, chunk_size=MAX_BATCH_SIZE,
+                              workers=4):
+        """ like expand_many(), but returns the clicks_by_minute for each
+        link """
+        return self._batch_lookup(self.clicks_by_minute, links, chunk_size,
+                                  workers)
+
+    def _batch_lookup(self, method, links, chunk_size, workers):
+        assert 0 < chunk_size <= MAX_BATCH_SIZE, \
+            "chunk_size must be between 1 and %d" % MAX_BATCH_SIZE
+
+        lookup = self._in_timeout_scope(
+            functools.partial(self._lookup_links, method))
+        for results in imap(lookup, chunked(links, chunk_size), workers):
+            for result in results:
+                yield result
+
+    def _coalesced(self, name, link):
+        """look up one link through a coalescer, within the deadline"""
+        timeout = _time_left(self._effective_timeouts()[2])
+        try:
+            return self._coalescers[name].submit(link, timeout)
+        except CoalesceTimeout:
+            raise BitlyTimeoutError('DEADLINE_EXCEEDED')
+
+    def _lookup_links(self, method, links):
+        """look up a list of hashes / short urls in one request"""
+        hashes = [link for link in links if '/' not in link]
+        short_urls = [link for link in links if '/' in link]
+        entries = method(hash=hashes or None, shortUrl=short_urls or None)
+        return _match_entries(links, entries)
+
     def link_lookup(self, url):
         """query for a bitly link based on a long url (or list of long urls)"""
         params = dict(url=url)
@@ -718,26 +1290,28 @@ class Connection(object):
     def _generateSignature(self, params, secret):
         if not params or not secret:
             return ""
-        hash_string = ""
         if not params.get('t'):
-            # note, this uses a utc timestamp not a local timestamp
-            params['t'] = str(int(time.mktime(time.gmtime())))
-
-        keys = params.keys()
-        keys.sort()
-        for k in keys:
-            if type(params[k]) in [types.ListType, types.TupleType]:
-                for v in params[k]:
-                    hash_string += v
-            else:
-                hash_string += params[k]
-        hash_string += secret
-        signature = hashlib.md5(hash_string).hexdigest()[:10]
-        return signature
+            params['t'] = _signature_timestamp()
+
+        # the md5 of the values in key order followed by the secret
+        pieces = []
+        for k in sorted(params):
+            value = params[k]
+            if isinstance(value, (list, tuple)):
+                pieces.extend(value)
+            elif value is not None:
+                pieces.append(value)
+        pieces.append(secret)
+        try:
+            data = ''.join(pieces).encode('utf-8')
+        except (TypeError, UnicodeDecodeError):
+            # numbers, bytes, or (python 2) non ascii str values
+            data = b''.join([_signature_bytes(piece) for piece in pieces])
+        return hashlib.md5(data).hexdigest()[:10]
 
     def _call_oauth2_metrics(self, endpoint, params, unit=None, units=None,
                              tz_offset=None, rollup=None, limit=None,
-                             unit_reference_ts=None):
+                             unit_reference_ts=None, decode=None):
         if unit is not None:
             assert unit in ("minute", "hour", "day", "week", "mweek", "month")
             params["unit"] = unit
@@ -765,13 +1339,220 @@ class Connection(object):
                     isinstance(unit_reference_ts, integer_types))
             params["unit_reference_ts"] = unit_reference_ts
 
-        return self._call_oauth2(endpoint, params)
+        return self._call_oauth2(endpoint, params, decode)
+
+    def _metrics_series(self, endpoint, params, kwargs):
+        """call a time series metrics endpoint for a columnar Series"""
+        assert not kwargs.get('rollup'), "as_arrays requires rollup=False"
+        kwargs['rollup'] = False
+        data = self._call_oauth2_metrics(endpoint, params,
+                                         decode=decode_buckets, **kwargs)
+        return to_series(find_buckets(data))
 
-    def _call_oauth2(self, endpoint, params):
+    def _call_oauth2(self, endpoint, params, decode=None):
         assert self.access_token, "This %s endpoint requires OAuth" % endpoint
-        return self._call(self.ssl_host, endpoint, params)["data"]
+        return self._call(self.ssl_host, endpoint, params,
+                          decode=decode)["data"]
+
+    def _call(self, host, method, params, secret=None, timeout=None,
+              decode=None):
+        """
+        call an api method. `timeout` (in milliseconds) overrides the read
+        timeout for this call. `decode` replaces json.loads for parsing the
+        response body; such calls are not cached.
+        """
+        if self.instrumentation is None:
+            return self._dispatch(host, method, params, secret, timeout,
+                                  decode)
+        event = CallEvent(method)
+        started = time.time()
+        try:
+            data = self._dispatch(host, method, params, secret, timeout,
+                                  decode, event)
+            event.status = event.status or 200
+            return data
+        except BitlyError as e:
+            event.status = e.code
+            event.error = e
+            raise
+        finally:
+            event.total_time = time.time() - started
+            self.instrumentation.record(event)
+
+    def _dispatch(self, host, method, params, secret, timeout, decode,
+                  event=None):
+        """answer a call from the cache, a shared call or a new request"""
+        cache_key = None
+        if decode is None:
+            cache_key = self._cache_key(method, params)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if event is not None:
+                event.cache = 'miss' if cached is None else 'hit'
+            if cached is not None:
+                return self.json_decoder(cached)
+        if self._single_flight is not None and method in IDEMPOTENT_METHODS:
+            return self._single_flight.do(
+                (host, decode, _params_key(method, params)), self._call_api,
+                host, method, params, secret, timeout, cache_key, decode,
+                event)
+        return self._call_api(host, method, params, secret, timeout,
+                              cache_key, decode, event)
+
+    def _call_api(self, host, method, params, secret, timeout, cache_key,
+                  decode=None, event=None):
+        timeouts = self._effective_timeouts(timeout)
+        scheme, host, path = self._build_request(host, method, params, secret)
+        data = self._send_retrying(method, scheme, host, path, timeouts,
+                                   decode, event)
+        if cache_key is not None:
+            self.cache.set(cache_key, json.dumps(data),
+                           self._cache_ttl(method, data))
+        return data
 
-    def _call(self, host, method, params, secret=None, timeout=5000):
+    def _cache_ttl(self, method, data):
+        """how long to cache a successful response"""
+        ttl = self.cache_ttls[method]
+        if _has_entry_errors(data):
+            return NEGATIVE_CACHE_TTL if ttl is None else min(
+                ttl, NEGATIVE_CACHE_TTL)
+        return ttl
+
+    def _cache_key(self, method, params):
+        """the cache key for a call, or None if it isn't cacheable"""
+        if self.cache is None or method not in self.cache_ttls:
+            return None
+        # don't put credentials in a possibly shared cache
+        key = _params_key(method, dict(
+            (k, v) for k, v in params.items() if k not in _SECRET_PARAMS))
+        if method in _USER_CACHE_METHODS:
+            user = params.get('x_login') or self.login or hashlib.sha1(
+                _utf8(self.access_token or '')).hexdigest()
+            key = "%s&%s" % (key, urlencode(dict(user=user)))
+        return key
+
+    def _send_retrying(self, method, scheme, host, path, timeouts,
+                       decode=None, event=None):
+        policy = self.retry_policy
+        if not policy or method not in IDEMPOTENT_METHODS:
+            return self._send(method, scheme, host, path, timeouts, decode,
+                              event)
+        started = policy.start()
+        deadline = timeouts[2]
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self._send(method, scheme, host, path, timeouts,
+                                  decode, event)
+            except BitlyError as e:
+                delay = policy.delay(attempt, started, e)
+                if delay is None:
+                    raise
+                if deadline is not None and time.time() + delay > deadline:
+                    raise
+            time.sleep(delay)
+
+    def _send(self, method, scheme, host, path, timeouts, decode=None,
+              event=None):
+        limiter = self._get_rate_limiter(method)
+        if limiter is None:
+            return self._request(scheme, host, path, timeouts, decode, event)
+        queued = time.time()
+        if not limiter.acquire(_time_left(timeouts[2])):
+            raise BitlyTimeoutError('DEADLINE_EXCEEDED')
+        if event is not None:
+            event.queue_time += time.time() - queued
+        rate_limited = False
+        try:
+            return self._request(scheme, host, path, timeouts, decode, event)
+        except BitlyError as e:
+            rate_limited = _is_rate_limited(e)
+            raise
+        finally:
+            limiter.release(rate_limited)
+
+    def _request(self, scheme, host, path, timeouts, decode=None,
+                 event=None):
+        connect_timeout, read_timeout = _remaining(timeouts)
+        try:
+            pool = self._get_pool(scheme, host)
+            if event is None:
+                response, body = pool.urlopen(
+                    path, self._headers(' httplib'), connect_timeout,
+                    read_timeout)
+                return self._parse_response(response.status, body,
+                                            decode or self.json_decoder)
+            event.attempts += 1
+            timings = {}
+            response, body = pool.urlopen(
+                path, self._headers(' httplib'), connect_timeout,
+                read_timeout, timings)
+            return self._parse_timed(event, timings, response.status, body,
+                                     decode or self.json_decoder)
+        except socket.timeout as e:
+            raise BitlyTimeoutError('TIMEOUT: %s' % e)
+        except (socket.error, httplib.HTTPException) as e:
+            raise BitlyError(500, str(e), transient=True)
+        except BitlyError:
+            raise
+        except Exception:
+            raise BitlyError(None, sys.exc_info()[1], transient=True)
+
+    def _headers(self, client):
+        """the headers sent with every request"""
+        headers = {'User-Agent': self.user_agent + client}
+        if self.compress:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        return headers
+
+    def _get_rate_limiter(self, method):
+        """the RateLimiter for the longest matching rate_limits prefix"""
+        if not self.rate_limits:
+            return None
+        best = None
+        for prefix in self.rate_limits:
+            if method.startswith(prefix) and (best is None or
+                                              len(prefix) > len(best)):
+                best = prefix
+        if best is None:
+            return None
+        return self.rate_limits[best]
+
+    def _build_request(self, host, method, params, secret=None):
+        """return the (scheme, host, path) to request for an api method"""
+        if secret or not _STATIC_PARAMS.isdisjoint(params):
+            return self._build_full_request(host, method, params, secret)
+        if self.access_token:
+            scheme, host = 'https', self.ssl_host
+        else:
+            scheme = 'http'
+        # only the call's own arguments need encoding; the method, format
+        # and credentials part of the url is cached
+        path = self._path_prefix(method)
+        query = urlencode(_utf8_params(params), doseq=1)
+        if query:
+            path = path + '&' + query
+        return scheme, host, path
+
+    def _path_prefix(self, method):
+        """the '/method?format=json&<credentials>' start of a request path"""
+        credentials = (self.access_token, self.login, self.api_key)
+        cached = self._path_prefixes.get(method)
+        if cached is not None and cached[0] == credentials:
+            return cached[1]
+        if self.access_token:
+            static = [('format', 'json'), ('access_token', self.access_token)]
+        else:
+            static = [('format', 'json'), ('login', self.login),
+                      ('apiKey', self.api_key)]
+        prefix = '/%s?%s' % (method, urlencode(
+            [(k, _utf8(v)) for k, v in static if v is not None]))
+        self._path_prefixes[method] = (credentials, prefix)
+        return prefix
+
+    def _build_full_request(self, host, method, params, secret=None):
+        """build a request path from scratch, signing it if `secret` is set"""
         params['format'] = params.get('format', 'json')  # default to json
 
         if self.access_token:
@@ -789,33 +1570,59 @@ class Connection(object):
         # force to utf8 to fix ascii codec errors
         params = _utf8_params(params)
 
-        request = "%(scheme)s://%(host)s/%(method)s?%(params)s" % {
-            'scheme': scheme,
-            'host': host,
+        path = "/%(method)s?%(params)s" % {
             'method': method,
             'params': urlencode(params, doseq=1)
             }
-
+        return scheme, host, path
+
+    def _parse_timed(self, event, timings, code, body, decode):
+        """_parse_response, recording the request in `event`"""
+        event.add_timings(timings)
+        event.bytes += len(body)
+        event.status = code
+        started = time.time()
         try:
-            opener = build_opener(DontRedirect())
-            opener.addheaders = [('User-agent', self.user_agent + ' urllib')]
-            response = opener.open(request)
-            code = response.code
-            result = response.read().decode('utf-8')
-            if code != 200:
-                raise BitlyError(500, result)
-            if not result.startswith('{'):
-                raise BitlyError(500, result)
-            data = json.loads(result)
-            if data.get('status_code', 500) != 200:
-                raise BitlyError(data.get('status_code', 500),
-                                 data.get('status_txt', 'UNKNOWN_ERROR'))
-            return data
-        except URLError as e:
-            raise BitlyError(500, str(e))
-        except HTTPError as e:
-            raise BitlyError(e.code, e.read())
-        except BitlyError:
-            raise
-        except Exception:
-            raise BitlyError(None, sys.exc_info()[1])
+            return self._parse_response(code, body, decode)
+        finally:
+            event.parse_time += time.time() - started
+
+    @staticmethod
+    def _parse_response(code, body, decode=None):
+        """
+        decode a raw api response, raising BitlyError on failure. `decode`
+        parses the json body bytes (default: bitly_api.fastjson.loads)
+        """
+        # redirects are not followed; they are reported like other errors
+        if not 200 <= code < 300:
+            raise BitlyError(code, body, transient=code >= 500)
+        if code != 200:
+            raise BitlyError(500, body.decode('utf-8', 'replace'))
+        if not body.startswith(b'{'):
+            raise BitlyError(500, body.decode('utf-8', 'replace'),
+                             transient=True)
+        data = (decode or loads)(body)
+        status_code = data.get('status_code', 500)
+        if status_code != 200:
+            raise BitlyError(status_code,
+                             data.get('status_txt', 'UNKNOWN_ERROR'),
+                             transient=status_code == 503)
+        return data
+
+    def _get_pool(self, scheme, host):
+        key = (scheme, host)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    if self.transport is not None:
+                        pool = self.transport.pool(scheme, host,
+                                                   self.pool_size,
+                                                   self.pool_idle_timeout)
+                    else:
+                        pool = self._pool_class(
+                            host, scheme, maxsize=self.pool_size,
+                            idle_timeout=self.pool_idle_timeout)
+                    self._pools[key] = pool
+        return pool
@@ -0,0 +1,267 @@
+"""
+helpers for running many api calls concurrently
+"""
+import sys
+import threading
+from itertools import islice
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+_DONE = object()
+
+
+def chunked(iterable, size):
+    """yield lists of up to `size` items from `iterable`"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap(func, iterable, workers=4, ordered=True, max_pending=None,
+         return_exceptions=False):
+    """
+    apply `func` to each item of `iterable` on a pool of `workers` threads
+
+    `iterable` is consumed lazily and at most `max_pending` (default twice the
+    number of workers) items are in flight or waiting to be yielded at any
+    time, so memory stays bounded however long the input is. results are
+    yielded in input order, or as they complete when `ordered` is False.
+
+    an exception raised by `func` is re-raised to the caller (stopping the
+    pool) unless `return_exceptions` is set, in which case the exception
+    instance is yielded in place of the result.
+    """
+    assert workers > 0
+    if max_pending is None:
+        max_pending = workers * 2
+    assert max_pending >= workers
+
+    iterator = iter(iterable)
+    input_lock = threading.Lock()
+    slots = threading.Semaphore(max_pending)
+    results = Queue()
+    state = {'index': 0, 'stop': False}
+
+    def work():
+        try:
+            while True:
+                slots.acquire()
+                with input_lock:
+                    if state['stop']:
+                        slots.release()
+                        return
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        slots.release()
+                        return
+                    index = state['index']
+                    state['index'] += 1
+                try:
+                    results.put((index, True, func(item)))
+                except Exception:
+                    results.put((index, False, sys.exc_info()[1]))
+        except Exception:
+            # the input iterator itself failed
+            results.put((None, False, sys.exc_info()[1]))
+        finally:
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    running = workers
+    waiting = {}
+    next_index = 0
+    try:
+        while running:
+            entry = results.get()
+            if entry is _DONE:
+                running -= 1
+                continue
+            index, ok, value = entry
+            if index is None:
+                raise value
+            if ordered:
+                waiting[index] = (ok, value)
+                ready = []
+                while next_index in waiting:
+                    ready.append(waiting.pop(next_index))
+                    next_index += 1
+            else:
+                ready = [(ok, value)]
+            for ok, value in ready:
+                slots.release()
+                if not ok and not return_exceptions:
+                    raise value
+                yield value
+    finally:
+        state['stop'] = True
+        for thread in threads:
+            slots.release()
+
+
+class _Batch(object):
+    def __init__(self):
+        self.links = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class CoalesceTimeout(Exception):
+    """a Coalescer.submit() gave up waiting for its batch"""
+
+
+class Coalescer(object):
+    """
+    merge single-link lookups made concurrently from many threads into
+    multi-link requests
+
+    `lookup(links)` must return one result per link, in order. the first
+    caller to arrive opens a batch and waits up to `window` seconds (or until
+    `max_items` links have joined) before issuing one lookup for the whole
+    batch; every caller then receives its own result, or the exception the
+    lookup raised. callers other than the first raise CoalesceTimeout if the
+    lookup hasn't finished within their `timeout`.
+    """
+
+    def __init__(self, lookup, window=0.005, max_items=15):
+        assert window >= 0
+        assert max_items > 0
+        self.lookup = lookup
+        self.window = window
+        self.max_items = max_items
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def submit(self, link, timeout=None):
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            index = len(batch.links)
+            batch.links.append(link)
+            if len(batch.links) >= self.max_items:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            try:
+                batch.results = self.lookup(batch.links)
+            except Exception:
+                batch.error = sys.exc_info()[1]
+            batch.done.set()
+        elif not batch.done.wait(timeout):
+            raise CoalesceTimeout(link)
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    de-duplicate concurrent identical calls: while a call for a key is in
+    flight, other threads calling do() with the same key wait for it and
+    receive the same result (or exception) instead of making their own call.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            try:
+                flight.result = func(*args)
+            except Exception:
+                flight.error = sys.exc_info()[1]
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+class MetricsTotals(object):
+    """
+    running totals of link metrics results, added one (link, result) pair at
+    a time so that no response is kept once it has been counted
+
+    with `key` each result is a list of dicts (ie: link_countries) and the
+    `value` field is summed per distinct `key` field, giving a dict. without
+    it each result is a number, a dict holding `value`, or a list of them
+    (ie: link_clicks buckets by day), and `totals` is a single sum.
+    BitlyError results are collected by link in `errors`.
+    """
+
+    def __init__(self, key=None, value='clicks'):
+        self.key = key
+        self.value = value
+        self.totals = {} if key is not None else 0
+        self.errors = {}
+
+    def add(self, link, result):
+        if isinstance(result, Exception):
+            self.errors[link] = result
+        elif self.key is not None:
+            for entry in result:
+                self.totals[entry[self.key]] = (
+                    self.totals.get(entry[self.key], 0) + entry[self.value])
+        elif isinstance(result, list):
+            for entry in result:
+                self._add_value(entry)
+        else:
+            self._add_value(result)
+
+    def _add_value(self, result):
+        if isinstance(result, dict):
+            self.totals += result[self.value]
+        else:
+            self.totals += result
+
+
+def sum_metrics(results, key=None, value='clicks'):
+    """
+    fold a stream of (link, result) pairs, as yielded by
+    Connection.metrics_many(), into totals in one pass (see MetricsTotals)
+
+    returns (totals, errors)
+    """
+    totals = MetricsTotals(key, value)
+    for link, result in results:
+        totals.add(link, result)
+    return totals.totals, totals.errors
@@ -0,0 +1,257 @@
+"""
+response caches for the bitly api
+
+a cache is any object with get(key) and set(key, value, ttl) methods (see
+CacheBackend); keys and values are strings and ttl is a number of seconds or
+None for no expiry.
+
+    LRUCache       in-process, per worker
+    SqliteCache    a file on local disk shared by the processes on a host
+    MemcacheCache  one or more memcached servers shared across hosts
+"""
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class CacheBackend(object):
+    """the interface Connection expects of its `cache`"""
+
+    def get(self, key):
+        """return the value stored for `key`, or None"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """store `value` for `key` for `ttl` seconds (None: no expiry)"""
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """
+    a thread safe in-process cache holding at most `maxsize` entries, evicting
+    the least recently used entry first. hits, misses, evictions and
+    expirations are counted.
+    """
+
+    def __init__(self, maxsize=10000):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.time():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """return a dict of the cache counters"""
+        with self._lock:
+            return dict(size=len(self._data), hits=self.hits,
+                        misses=self.misses, evictions=self.evictions,
+                        expirations=self.expirations)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteCache(CacheBackend):
+    """
+    a cache stored in a sqlite database file, so that every worker process on
+    a host can share one copy of the cached responses.
+
+    once more than `maxsize` entries are stored the oldest ones are removed
+    (checked every `trim_interval` writes). each thread and process uses its
+    own sqlite connection; sqlite takes care of locking the file.
+    """
+
+    def __init__(self, path, maxsize=1000000, trim_interval=1000):
+        self.path = path
+        self.maxsize = maxsize
+        self.trim_interval = trim_interval
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._db().execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value TEXT, expires REAL, updated REAL)')
+        self._db().execute(
+            'CREATE INDEX IF NOT EXISTS cache_updated ON cache (updated)')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        # connections must not be shared with a forked child
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        row = self._db().execute(
+            'SELECT value, expires FROM cache WHERE key = ?',
+            (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        db = self._db()
+        db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                   (key, value, expires, now))
+        self._writes += 1
+        if self._writes % self.trim_interval == 0:
+            self.trim()
+
+    def trim(self):
+        """remove expired entries, then the oldest beyond maxsize"""
+        db = self._db()
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                   'ORDER BY updated DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def stats(self):
+        size = self._db().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return dict(size=size, hits=self.hits, misses=self.misses)
+
+
+class MemcacheCache(CacheBackend):
+    """
+    a cache kept on memcached servers, spoken to with the memcached text
+    protocol. `servers` is a list of "host:port" strings; keys are spread
+    across them by hash.
+
+    a failing server is treated as a cache miss so that an unavailable cache
+    never fails an api call.
+    """
+
+    # memcached treats expiry times beyond 30 days as unix timestamps
+    _MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+
+    def __init__(self, servers=('127.0.0.1:11211',), timeout=0.5,
+                 prefix='bitly_api:'):
+        assert servers
+        self.servers = []
+        for server in servers:
+            host, _, port = server.partition(':')
+            self.servers.append((host, int(port or 11211)))
+        self.timeout = timeout
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._local = threading.local()
+
+    def _key(self, key):
+        # memcached keys are limited to 250 bytes without whitespace
+        return (self.prefix +
+                hashlib.md5(key.encode('utf-8')).hexdigest()).encode('ascii')
+
+    def _server(self, key):
+        return self.servers[zlib.crc32(key) % len(self.servers)]
+
+    def _socket(self, server):
+        sockets = getattr(self._local, 'sockets', None)
+        if sockets is None or self._local.pid != os.getpid():
+            sockets = self._local.sockets = {}
+            self._local.pid = os.getpid()
+        sock = sockets.get(server)
+        if sock is None:
+            sock = socket.create_connection(server, self.timeout)
+            sockets[server] = sock.makefile('rwb')
+            sock.close()
+        return sockets[server]
+
+    def _command(self, key, func):
+        server = self._server(key)
+        try:
+            return func(self._socket(server))
+        except (socket.error, ValueError):
+            self.errors += 1
+            sock = self._local.sockets.pop(server, None)
+            if sock is not None:
+                sock.close()
+            return None
+
+    def get(self, key):
+        key = self._key(key)
+
+        def get(sock):
+            sock.write(b'get ' + key + b'\r\n')
+            sock.flush()
+            value = None
+            while True:
+                line = sock.readline()
+                if line == b'END\r\n':
+                    return value
+                parts = line.split()
+                if len(parts) != 4 or parts[0] != b'VALUE':
+                    raise ValueError('unexpected response %r' % line)
+                value = sock.read(int(parts[3]) + 2)[:-2].decode('utf-8')
+
+        value = self._command(key, get)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        key = self._key(key)
+        value = value.encode('utf-8')
+        if ttl is None:
+            exptime = 0
+        elif ttl > self._MAX_RELATIVE_TTL:
+            exptime = int(time.time() + ttl)
+        else:
+            exptime = max(1, int(ttl))
+
+        def set(sock):
+            sock.write(b'set ' + key + (' 0 %d %d\r\n' % (
+                exptime, len(value))).encode('ascii') + value + b'\r\n')
+            sock.flush()
+            line = sock.readline()
+            if line not in (b'STORED\r\n', b'NOT_STORED\r\n'):
+                raise ValueError('unexpected response %r' % line)
+
+        self._command(key, set)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, errors=self.errors)
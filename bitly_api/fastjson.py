@@ -0,0 +1,84 @@
+"""
+json decoding of api responses
+
+loads() parses a response body given as bytes, without first decoding it to
+text. it uses orjson or ujson when one is installed and the standard library
+json module otherwise; BACKEND names the one in use.
+
+select_fields() builds decoders that keep only some fields of each record.
+"""
+import functools
+import json
+import sys
+
+# before python 3.6 json.loads only accepts text
+_DECODE_BYTES = (3, 0) <= sys.version_info < (3, 6)
+
+
+def stdlib_loads(data, **kwargs):
+    """json.loads accepting utf-8 bytes on every python version"""
+    if _DECODE_BYTES and isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data, **kwargs)
+
+
+try:
+    import orjson
+    loads = orjson.loads
+    BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson
+        loads = ujson.loads
+        BACKEND = 'ujson'
+    except ImportError:
+        loads = stdlib_loads
+        BACKEND = 'json'
+
+
+_selectors = {}
+
+
+def select_fields(fields, markers):
+    """
+    a decoder that keeps only `fields` of the records in a response, so large
+    pages never hold the keys a caller doesn't use. records are the objects
+    containing any of the `markers` keys; their markers and 'error' are
+    always kept. a dotted field (ie: 'encoding_user.login') picks a value out
+    of a nested object and is stored under the dotted name.
+
+    the decoder is built on the stdlib parser's object_pairs_hook: a record
+    is filtered straight from its key/value pairs without first building the
+    full dict.
+    """
+    fields = tuple(fields)
+    markers = tuple(markers)
+    decoder = _selectors.get((fields, markers))
+    if decoder is not None:
+        return decoder
+
+    nested = [field.split('.') for field in fields if '.' in field]
+    drop = set(path[0] for path in nested) - set(fields)
+    keep = frozenset(set(fields) | drop | set(markers) | set(['error']))
+    marker_keys = frozenset(markers)
+
+    def hook(pairs):
+        selected = [(key, value) for key, value in pairs if key in keep]
+        for key, value in selected:
+            if key in marker_keys:
+                break
+        else:
+            return dict(pairs)
+        record = dict(selected)
+        for path in nested:
+            value = record.get(path[0])
+            for key in path[1:]:
+                value = value.get(key) if isinstance(value, dict) else None
+            record['.'.join(path)] = value
+        for key in drop:
+            record.pop(key, None)
+        return record
+
+    decoder = functools.partial(stdlib_loads, object_pairs_hook=hook)
+    _selectors[(fields, markers)] = decoder
+    return decoder
@@ -0,0 +1,318 @@
+"""
+iterators over a user's link and network history
+
+both pagers yield one record at a time while holding at most two pages in
+memory: the page being consumed and, with prefetch, the next page which is
+fetched on a background thread in the meantime.
+
+link history is paged by time rather than by deep offsets: each page asks
+for links created before the oldest link seen so far, with a small offset to
+skip links that share that second and were already returned. the position
+after the last record yielded is available from checkpoint() as a dict that
+can be stored and passed back in to resume later:
+
+    pager = c.iter_user_link_history()
+    for link in pager:
+        save(link)
+        state = pager.checkpoint()
+    ...
+    for link in c.iter_user_link_history(checkpoint=state):
+        ...
+"""
+import csv
+import json
+import sys
+import threading
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+# unicode on python 2, str on python 3
+text_type = type(u'')
+
+# the most records the api returns in one page of link or network history;
+# a larger limit is silently capped
+MAX_PAGE_SIZE = 100
+
+
+class _Prefetch(object):
+    """call func(*args) on a background thread"""
+
+    def __init__(self, func, *args):
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(func, args))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, args):
+        try:
+            self._result = func(*args)
+        except Exception:
+            self._error = sys.exc_info()[1]
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _Immediate(object):
+    """call func(*args) now; the synchronous counterpart of _Prefetch"""
+
+    def __init__(self, func, *args):
+        self._result = func(*args)
+
+    def result(self):
+        return self._result
+
+
+def _link_history(connection, fields, **kwargs):
+    """call user_link_history, selecting `fields` if given"""
+    if fields is not None:
+        kwargs['fields'] = fields
+    return connection.user_link_history(**kwargs)
+
+
+class _Pager(object):
+    """
+    subclasses implement _fetch(cursor) returning a page of records and
+    _after(cursor, record) returning the cursor following `record`
+    """
+
+    def __init__(self, connection, cursor, page_size, prefetch):
+        # a page shorter than page_size is taken to be the last one
+        assert 0 < page_size <= MAX_PAGE_SIZE, \
+            "page_size must be between 1 and %d" % MAX_PAGE_SIZE
+        self.connection = connection
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self._cursor = cursor
+
+    def _start(self, cursor):
+        fetch = self.connection._in_timeout_scope(self._fetch)
+        if self.prefetch:
+            return _Prefetch(fetch, cursor)
+        return _Immediate(fetch, cursor)
+
+    def __iter__(self):
+        cursor = self._cursor
+        pending = self._start(cursor)
+        while pending is not None:
+            records = pending.result()
+            pending = None
+            if len(records) >= self.page_size:
+                for record in records:
+                    cursor = self._after(cursor, record)
+                pending = self._start(cursor)
+            for record in records:
+                self._cursor = self._after(self._cursor, record)
+                yield record
+
+
+class LinkHistoryPager(_Pager):
+    """iterate over Connection.user_link_history, newest link first"""
+
+    def __init__(self, connection, created_before=None, created_after=None,
+                 archived=None, private=None, page_size=100, prefetch=True,
+                 checkpoint=None, fields=None):
+        if checkpoint is None:
+            checkpoint = dict(created_before=created_before, offset=0)
+        cursor = (checkpoint['created_before'], checkpoint['offset'])
+        _Pager.__init__(self, connection, cursor, page_size, prefetch)
+        self.created_after = created_after
+        self.archived = archived
+        self.private = private
+        # paging needs created_at whichever fields the caller wants
+        if fields is not None and 'created_at' not in fields:
+            fields = list(fields) + ['created_at']
+        self.fields = fields
+
+    def checkpoint(self):
+        """the position after the last link yielded"""
+        created_before, offset = self._cursor
+        return dict(created_before=created_before, offset=offset)
+
+    def _fetch(self, cursor):
+        created_before, offset = cursor
+        return _link_history(
+            self.connection, self.fields, created_before=created_before,
+            created_after=self.created_after, archived=self.archived,
+            private=self.private, limit=self.page_size, offset=offset or None)
+
+    def _after(self, cursor, record):
+        created_before, offset = cursor
+        created_at = int(record['created_at'])
+        if created_at + 1 == created_before:
+            return created_before, offset + 1
+        return created_at + 1, 1
+
+
+class NetworkHistoryPager(_Pager):
+    """
+    iterate over the entries of Connection.user_network_history. the api
+    only supports offset paging for network history.
+    """
+
+    def __init__(self, connection, expand_client_id=False, expand_user=False,
+                 page_size=30, prefetch=True, checkpoint=None):
+        offset = checkpoint['offset'] if checkpoint else 0
+        _Pager.__init__(self, connection, offset, page_size, prefetch)
+        self.expand_client_id = expand_client_id
+        self.expand_user = expand_user
+
+    def checkpoint(self):
+        """the position after the last entry yielded"""
+        return dict(offset=self._cursor)
+
+    def _fetch(self, offset):
+        data = self.connection.user_network_history(
+            offset=offset, expand_client_id=self.expand_client_id,
+            limit=self.page_size, expand_user=self.expand_user)
+        return data['entries']
+
+    def _after(self, offset, record):
+        return offset + 1
+
+
+# the columns written by export_link_history(format='csv') by default
+CSV_FIELDS = ['link', 'long_url', 'title', 'created_at', 'modified_at',
+              'user_ts', 'archived', 'private', 'tags']
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value)
+    if text_type is not str and isinstance(value, text_type):
+        # python 2's csv module only writes byte strings
+        value = value.encode('utf-8')
+    return value
+
+
+class _Window(object):
+    """links created in [start, end) seconds"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.submitted = False
+        self.records = None
+
+
+def export_link_history(connection, out, format='ndjson', created_after=None,
+                        created_before=None, archived=None, private=None,
+                        shards=16, workers=4, page_size=100, lookahead=None,
+                        fields=CSV_FIELDS):
+    """
+    write a user's whole link history to the file object `out`, newest link
+    first, as newline delimited json (format='ndjson') or csv
+    (format='csv', with the columns in `fields`; on python 2 text is written
+    utf-8 encoded). returns the number of links written.
+
+    the time range (default: from the user's member_since until now) is
+    split into `shards` windows which are fetched concurrently by `workers`
+    threads. a window whose first page comes back full is split in two, so
+    dense periods end up in many small windows and sparse ones in few; most
+    windows then take a single request. windows are disjoint, so no link is
+    written twice, and are written out in order as soon as every newer
+    window is done. at most `lookahead` (default 4 * workers) windows are
+    fetched ahead of the one being written, which bounds memory.
+    """
+    assert format in ('ndjson', 'csv')
+    assert shards > 0 and workers > 0
+    # a window whose page comes back full is split, so the page must be one
+    # the api can fill
+    assert 0 < page_size <= MAX_PAGE_SIZE, \
+        "page_size must be between 1 and %d" % MAX_PAGE_SIZE
+    if lookahead is None:
+        lookahead = workers * 4
+    if created_before is None:
+        created_before = int(time.time()) + 1
+    if created_after is None:
+        created_after = int(connection.user_info().get('member_since', 0)) - 1
+    # the api's created_after/created_before bounds are exclusive
+    start, end = created_after + 1, created_before
+    if start >= end:
+        return 0
+
+    step = max(1, (end - start + shards - 1) // shards)
+    frontier = [_Window(max(start, t - step), t)
+                for t in range(end, start, -step)]
+
+    # csv only writes `fields`, so only those are parsed
+    select = fields if format == 'csv' else None
+
+    def fetch(window):
+        records = _link_history(
+            connection, select, created_before=window.end,
+            created_after=window.start - 1, archived=archived,
+            private=private, limit=page_size)
+        if len(records) >= page_size and window.end - window.start == 1:
+            # more links in one second than fit a page: read them all
+            records.extend(LinkHistoryPager(
+                connection, created_after=window.start - 1,
+                archived=archived, private=private, page_size=page_size,
+                prefetch=False, fields=select,
+                checkpoint=dict(created_before=window.end,
+                                offset=len(records))))
+        return records
+
+    fetch = connection._in_timeout_scope(fetch)
+    tasks = Queue()
+    results = Queue()
+
+    def work():
+        while True:
+            window = tasks.get()
+            if window is None:
+                return
+            try:
+                results.put((window, fetch(window), None))
+            except Exception:
+                results.put((window, None, sys.exc_info()[1]))
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    if format == 'csv':
+        writer = csv.DictWriter(out, fields, extrasaction='ignore')
+        writer.writeheader()
+
+        def write(record):
+            writer.writerow(dict((k, _csv_value(v))
+                                 for k, v in record.items()))
+    else:
+        def write(record):
+            out.write(json.dumps(dict(record)) + '\n')
+
+    written = 0
+    try:
+        while frontier:
+            for window in frontier[:lookahead]:
+                if not window.submitted:
+                    window.submitted = True
+                    tasks.put(window)
+            window, records, error = results.get()
+            if error is not None:
+                raise error
+            if len(records) >= page_size and window.end - window.start > 1:
+                middle = (window.start + window.end) // 2
+                i = frontier.index(window)
+                frontier[i:i + 1] = [_Window(middle, window.end),
+                                     _Window(window.start, middle)]
+            else:
+                window.records = records
+            while frontier and frontier[0].records is not None:
+                for record in frontier.pop(0).records:
+                    write(record)
+                    written += 1
+    finally:
+        for thread in threads:
+            tasks.put(None)
+    return written
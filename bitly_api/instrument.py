@@ -0,0 +1,251 @@
+"""
+per call instrumentation
+
+pass Connection(instrumentation=...) any object with a record(event) method
+(see Instrumentation) and it is called once at the end of every api call
+with a CallEvent describing it. HistogramCollector is a built in, in-memory
+collector; prometheus_text() and statsd_text() export what it has collected:
+
+    stats = bitly_api.HistogramCollector()
+    c = bitly_api.Connection(access_token='...', instrumentation=stats)
+    ...
+    print(bitly_api.instrument.prometheus_text(stats))
+
+record() runs on the calling thread (or event loop), so it should be quick.
+"""
+import threading
+from bisect import bisect_left
+
+
+class CallEvent(object):
+    """
+    what happened during one api call. times are in seconds and cover every
+    attempt of a retried call; phases that didn't happen (ie: connecting on
+    a reused connection, anything on a cache hit) are 0.
+
+        method      the api method, ie: 'v3/expand'
+        status      the http status or api status_code of the response, or
+                    the code of the BitlyError raised (None: no response)
+        error       the BitlyError raised, or None
+        cache       'hit', 'miss', or None when the call isn't cacheable
+        attempts    number of requests sent (0 on a cache hit)
+        queue_time  waiting for a rate limiter
+        connect_time  dns lookup and connecting new connections
+        ttfb        from sending a request to its response headers
+        read_time   reading (and decompressing) response bodies
+        parse_time  decoding the json
+        total_time  the whole call
+        bytes       size of the (decompressed) response bodies
+    """
+
+    __slots__ = ('method', 'status', 'error', 'cache', 'attempts',
+                 'queue_time', 'connect_time', 'ttfb', 'read_time',
+                 'parse_time', 'total_time', 'bytes')
+
+    def __init__(self, method):
+        self.method = method
+        self.status = None
+        self.error = None
+        self.cache = None
+        self.attempts = 0
+        self.queue_time = 0.0
+        self.connect_time = 0.0
+        self.ttfb = 0.0
+        self.read_time = 0.0
+        self.parse_time = 0.0
+        self.total_time = 0.0
+        self.bytes = 0
+
+    def add_timings(self, timings):
+        """add the phase timings reported by a connection pool"""
+        self.connect_time += timings.get('connect', 0.0)
+        self.ttfb += timings.get('ttfb', 0.0)
+        self.read_time += timings.get('read', 0.0)
+
+    def __repr__(self):
+        return 'CallEvent(%s)' % ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+
+
+class Instrumentation(object):
+    """the interface Connection expects of its `instrumentation`"""
+
+    def record(self, event):
+        """called with the CallEvent of every finished call"""
+        pass
+
+
+# latency histogram bucket bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+PHASES = ('queue_time', 'connect_time', 'ttfb', 'read_time', 'parse_time')
+
+
+class MethodStats(object):
+    """the totals HistogramCollector keeps for one api method"""
+
+    def __init__(self, buckets):
+        self.count = 0
+        # per latency bucket, the last one counting calls slower than all
+        self.latency_counts = [0] * (len(buckets) + 1)
+        self.latency_sum = 0.0
+        self.phase_sums = dict((phase, 0.0) for phase in PHASES)
+        self.statuses = {}
+        self.bytes = 0
+        self.attempts = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class HistogramCollector(Instrumentation):
+    """
+    a thread safe, in-memory collector of call counts, statuses, latency
+    histograms, time per phase, bytes, attempts and cache hits per api method
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        bucket = bisect_left(self.buckets, event.total_time)
+        with self._lock:
+            stats = self._stats.get(event.method)
+            if stats is None:
+                stats = self._stats[event.method] = MethodStats(self.buckets)
+            stats.count += 1
+            stats.latency_counts[bucket] += 1
+            stats.latency_sum += event.total_time
+            for phase in PHASES:
+                stats.phase_sums[phase] += getattr(event, phase)
+            stats.statuses[event.status] = \
+                stats.statuses.get(event.status, 0) + 1
+            stats.bytes += event.bytes
+            stats.attempts += event.attempts
+            if event.cache == 'hit':
+                stats.cache_hits += 1
+            elif event.cache == 'miss':
+                stats.cache_misses += 1
+
+    def methods(self):
+        """the api methods called so far"""
+        with self._lock:
+            return sorted(self._stats)
+
+    def stats(self, method):
+        """the MethodStats of `method`, or None"""
+        return self._stats.get(method)
+
+    def quantile(self, method, q):
+        """
+        estimate the `q` quantile (0 < q <= 1) of the latency of `method`
+        from its histogram: the upper bound of the bucket holding it, or
+        None if it is beyond the last bucket or there were no calls
+        """
+        stats = self._stats.get(method)
+        if stats is None or not stats.count:
+            return None
+        target = q * stats.count
+        seen = 0
+        for bound, count in zip(self.buckets, stats.latency_counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text(collector, namespace='bitly_api'):
+    """the collector's totals in the prometheus text exposition format"""
+    lines = []
+
+    def metric(name, kind, help):
+        lines.append('# HELP %s_%s %s' % (namespace, name, help))
+        lines.append('# TYPE %s_%s %s' % (namespace, name, kind))
+
+    def sample(name, labels, value):
+        lines.append('%s_%s{%s} %s' % (namespace, name, ','.join(
+            '%s="%s"' % (k, _label(v)) for k, v in labels), repr(value)))
+
+    stats = [(method, collector.stats(method))
+             for method in collector.methods()]
+
+    metric('call_duration_seconds', 'histogram', 'api call latency')
+    for method, s in stats:
+        seen = 0
+        for bound, count in zip(collector.buckets, s.latency_counts):
+            seen += count
+            sample('call_duration_seconds_bucket',
+                   [('method', method), ('le', repr(bound))], seen)
+        sample('call_duration_seconds_bucket',
+               [('method', method), ('le', '+Inf')], s.count)
+        sample('call_duration_seconds_sum', [('method', method)],
+               s.latency_sum)
+        sample('call_duration_seconds_count', [('method', method)], s.count)
+
+    metric('calls_total', 'counter', 'api calls by response status')
+    for method, s in stats:
+        for status, count in sorted(s.statuses.items(), key=str):
+            sample('calls_total', [('method', method), ('status', status)],
+                   count)
+
+    metric('phase_seconds_total', 'counter', 'time spent per call phase')
+    for method, s in stats:
+        for phase in PHASES:
+            sample('phase_seconds_total',
+                   [('method', method), ('phase', phase.replace('_time', ''))],
+                   s.phase_sums[phase])
+
+    metric('response_bytes_total', 'counter', 'response body bytes')
+    for method, s in stats:
+        sample('response_bytes_total', [('method', method)], s.bytes)
+
+    metric('requests_total', 'counter', 'requests sent, including retries')
+    for method, s in stats:
+        sample('requests_total', [('method', method)], s.attempts)
+
+    metric('cache_total', 'counter', 'response cache lookups')
+    for method, s in stats:
+        if s.cache_hits or s.cache_misses:
+            sample('cache_total', [('method', method), ('result', 'hit')],
+                   s.cache_hits)
+            sample('cache_total', [('method', method), ('result', 'miss')],
+                   s.cache_misses)
+    return '\n'.join(lines) + '\n'
+
+
+def statsd_text(collector, prefix='bitly_api'):
+    """
+    the collector's totals as statsd gauges, one per line; gauges (rather
+    than counters) can be sent again on every flush without double counting
+    """
+    lines = []
+    for method in collector.methods():
+        s = collector.stats(method)
+        name = '%s.%s' % (prefix, method.replace('/', '.'))
+        lines.append('%s.calls:%d|g' % (name, s.count))
+        lines.append('%s.requests:%d|g' % (name, s.attempts))
+        lines.append('%s.bytes:%d|g' % (name, s.bytes))
+        if s.count:
+            lines.append('%s.latency_mean_ms:%.3f|g' % (
+                name, s.latency_sum * 1000 / s.count))
+        for q in (0.5, 0.99):
+            bound = collector.quantile(method, q)
+            if bound is not None:
+                lines.append('%s.latency_p%d_ms:%.3f|g' % (
+                    name, q * 100, bound * 1000))
+        for status, count in sorted(s.statuses.items(), key=str):
+            lines.append('%s.status.%s:%d|g' % (name, status, count))
+        if s.cache_hits or s.cache_misses:
+            lines.append('%s.cache_hits:%d|g' % (name, s.cache_hits))
+            lines.append('%s.cache_misses:%d|g' % (name, s.cache_misses))
+    return '\n'.join(lines) + ('\n' if lines else '')
@@ -0,0 +1,179 @@
+"""
+incremental syncing of time series metrics
+
+rather than downloading a metric's whole history on every poll, MetricsSync
+remembers per (endpoint, link, unit) the start of the newest bucket known to
+be complete (its watermark) and asks only for the buckets after it:
+
+    sync = bitly_api.MetricsSync(c, bitly_api.SqliteMetricsStore('m.db'))
+    series = sync.sync('link_clicks', 'http://bit.ly/xyz', unit='hour')
+
+series buckets are the dicts the api returns with rollup=False, keyed by
+their 'dt' timestamp, newest first. the bucket containing the current time
+is still filling up, so it is re-fetched (and replaced) on the next sync.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+# bucket lengths in seconds; month and mweek use an upper bound since
+# fetching one bucket too many is harmless
+UNIT_SECONDS = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 60 * 60 * 24,
+    'week': 60 * 60 * 24 * 7,
+    'mweek': 60 * 60 * 24 * 7,
+    'month': 60 * 60 * 24 * 31,
+}
+
+
+class MemoryMetricsStore(object):
+    """an in-process store of synced buckets and watermarks"""
+
+    def __init__(self):
+        self._series = {}
+        self._watermarks = {}
+        self._lock = threading.Lock()
+
+    def watermark(self, key):
+        """the dt of the newest complete bucket for `key`, or None"""
+        return self._watermarks.get(key)
+
+    def merge(self, key, buckets, watermark):
+        """add or replace `buckets` and move the watermark"""
+        with self._lock:
+            series = self._series.setdefault(key, {})
+            for bucket in buckets:
+                series[bucket['dt']] = bucket
+            if watermark is not None:
+                self._watermarks[key] = watermark
+
+    def series(self, key):
+        """all buckets stored for `key`, newest first"""
+        series = self._series.get(key, {})
+        return [series[dt] for dt in sorted(series, reverse=True)]
+
+
+class SqliteMetricsStore(object):
+    """a store of synced buckets and watermarks in a sqlite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self._db()
+        db.execute('CREATE TABLE IF NOT EXISTS watermarks '
+                   '(key TEXT PRIMARY KEY, dt INTEGER)')
+        db.execute('CREATE TABLE IF NOT EXISTS buckets '
+                   '(key TEXT, dt INTEGER, value TEXT, PRIMARY KEY (key, dt))')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def watermark(self, key):
+        row = self._db().execute('SELECT dt FROM watermarks WHERE key = ?',
+                                 (key,)).fetchone()
+        return row and row[0]
+
+    def merge(self, key, buckets, watermark):
+        db = self._db()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                           [(key, bucket['dt'], json.dumps(bucket))
+                            for bucket in buckets])
+            if watermark is not None:
+                db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?)',
+                           (key, watermark))
+
+    def series(self, key):
+        rows = self._db().execute(
+            'SELECT value FROM buckets WHERE key = ? ORDER BY dt DESC', (key,))
+        return [json.loads(row[0]) for row in rows]
+
+
+def _buckets(result):
+    """the list of per-unit buckets in a rollup=False metrics result"""
+    if isinstance(result, list):
+        return result
+    for value in result.values():
+        if isinstance(value, list) and value and 'dt' in value[0]:
+            return value
+    return []
+
+
+class MetricsSync(object):
+    """
+    keep a local copy of time series metrics up to date with as few and as
+    small requests as possible. `endpoint` is the name of a Connection
+    method accepting unit, units, rollup and unit_reference_ts (ie:
+    link_clicks, user_clicks, user_referrers).
+
+    the first sync of a series fetches `initial_units` buckets; later syncs
+    fetch the buckets since the watermark plus the current one, in requests
+    of at most `max_units`.
+    """
+
+    def __init__(self, connection, store=None, initial_units=30,
+                 max_units=1000):
+        self.connection = connection
+        self.store = store if store is not None else MemoryMetricsStore()
+        self.initial_units = initial_units
+        self.max_units = max_units
+
+    @staticmethod
+    def key(endpoint, link=None, unit='day', tz_offset=None):
+        return '|'.join([endpoint, link or '', unit, str(tz_offset or '')])
+
+    def sync(self, endpoint, link=None, unit='day', tz_offset=None):
+        """fetch new buckets; returns the whole stored series"""
+        key = self.key(endpoint, link, unit, tz_offset)
+        self.update(endpoint, link, unit, tz_offset)
+        return self.store.series(key)
+
+    def update(self, endpoint, link=None, unit='day', tz_offset=None):
+        """fetch and store new buckets; returns the buckets fetched"""
+        assert unit in UNIT_SECONDS
+        key = self.key(endpoint, link, unit, tz_offset)
+        now = int(time.time())
+        watermark = self.store.watermark(key)
+        if watermark is None:
+            needed = self.initial_units
+        else:
+            # every bucket after the watermark, including the current one
+            needed = max(1, (now - watermark) // UNIT_SECONDS[unit] + 1)
+
+        # more than max_units are fetched a page at a time, going back from
+        # the oldest bucket of the previous page, so no gap is left behind
+        # the watermark
+        buckets = []
+        reference_ts = now
+        while needed > 0:
+            units = min(self.max_units, needed)
+            page = self._fetch(endpoint, link, unit, units, reference_ts,
+                               tz_offset)
+            buckets.extend(page)
+            needed -= units
+            if not page:
+                break
+            reference_ts = min(bucket['dt'] for bucket in page) - 1
+            if watermark is not None and reference_ts < watermark:
+                break
+
+        # the newest bucket is still in progress; those before it are final
+        starts = sorted(set(bucket['dt'] for bucket in buckets))
+        if len(starts) > 1:
+            watermark = max(watermark or 0, starts[-2])
+        self.store.merge(key, buckets, watermark)
+        return buckets
+
+    def _fetch(self, endpoint, link, unit, units, reference_ts, tz_offset):
+        args = (link,) if link is not None else ()
+        kwargs = dict(unit=unit, units=units, rollup=False,
+                      unit_reference_ts=reference_ts)
+        if tz_offset is not None:
+            kwargs['tz_offset'] = tz_offset
+        return _buckets(getattr(self.connection, endpoint)(*args, **kwargs))
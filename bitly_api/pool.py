@@ -0,0 +1,189 @@
+import socket
+import threading
+import time
+import zlib
+from collections import deque
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+# how much of a compressed body is read and decompressed at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class Decompressor(object):
+    """
+    incrementally decode a response body sent with Content-Encoding
+    `encoding` (gzip, deflate, or none). deflate bodies may be zlib wrapped,
+    as the spec says, or raw, as some servers send them.
+    """
+
+    def __init__(self, encoding=None):
+        encoding = (encoding or '').strip().lower()
+        self._raw_fallback = encoding == 'deflate'
+        if encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._obj = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self._obj = None
+
+    @property
+    def identity(self):
+        return self._obj is None
+
+    def decompress(self, data):
+        if self._obj is None:
+            return data
+        if self._raw_fallback:
+            self._raw_fallback = False
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self):
+        if self._obj is None:
+            return b''
+        return self._obj.flush()
+
+
+def _read_body(response):
+    """read a response's body, decompressing it as it arrives"""
+    decompressor = Decompressor(response.getheader('content-encoding'))
+    if decompressor.identity:
+        return response.read()
+    chunks = []
+    while True:
+        data = response.read(CHUNK_SIZE)
+        if not data:
+            break
+        chunks.append(decompressor.decompress(data))
+    chunks.append(decompressor.flush())
+    return b''.join(chunks)
+
+
+def _closed_unanswered(error):
+    """
+    whether `error`, raised waiting for a response, means the server closed
+    the connection without sending any of one
+    """
+    disconnected = getattr(httplib, 'RemoteDisconnected', None)
+    if disconnected is not None:
+        return isinstance(error, disconnected)
+    # python 2 raises BadStatusLine with this message for an empty response
+    return (isinstance(error, httplib.BadStatusLine) and
+            'No status line received' in str(error))
+
+
+class HTTPConnectionPool(object):
+    """
+    a thread safe pool of persistent HTTP/1.1 connections to a single host
+
+    connections are handed out LIFO so the most recently used (and most likely
+    still open) socket is reused first. at most `maxsize` idle connections are
+    kept; callers are never blocked waiting for one, a new connection is opened
+    instead. idle connections older than `idle_timeout` seconds are closed
+    rather than reused.
+    """
+
+    def __init__(self, host, scheme='http', maxsize=10, idle_timeout=60):
+        assert scheme in ('http', 'https')
+        assert maxsize >= 0
+        self.host = host
+        self.scheme = scheme
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def _new_conn(self, connect_timeout=None):
+        if self.scheme == 'https':
+            conn = httplib.HTTPSConnection(self.host, timeout=connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(self.host, timeout=connect_timeout)
+        conn.connect()
+        return conn
+
+    def _get_conn(self, connect_timeout=None):
+        """return (connection, reused)"""
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._new_conn(connect_timeout), False
+
+    def _put_conn(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def urlopen(self, path, headers=None, connect_timeout=None,
+                read_timeout=None, timings=None):
+        """
+        issue a GET for `path` and return (response, body). a gzip or
+        deflate encoded body is decompressed.
+
+        if a `timings` dict is given the seconds spent getting a connection
+        ('connect'), waiting for the response headers ('ttfb') and reading
+        the body ('read') are stored in it.
+
+        `connect_timeout` bounds establishing a new connection and
+        `read_timeout` each blocking read or write on the socket; both are in
+        seconds and raise socket.timeout when exceeded.
+
+        if a reused connection turns out to have been closed by the server the
+        request is transparently sent again once on a fresh connection. it
+        is never sent again once any of a response has been received, as
+        the server may have acted on it.
+        """
+        started = time.time()
+        conn, reused = self._get_conn(connect_timeout)
+        connected = time.time()
+        while True:
+            sent = False
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(read_timeout)
+                conn.request('GET', path, headers=headers or {})
+                sent = True
+                response = conn.getresponse()
+                first_byte = time.time()
+                # from here on the server has answered
+                reused = False
+                body = _read_body(response)
+            except socket.timeout:
+                conn.close()
+                raise
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if not reused or (sent and not _closed_unanswered(e)):
+                    raise
+                conn, reused = self._new_conn(connect_timeout), False
+                connected = time.time()
+                continue
+            if timings is not None:
+                now = time.time()
+                timings['connect'] = connected - started
+                timings['ttfb'] = first_byte - connected
+                timings['read'] = now - first_byte
+            if response.will_close:
+                conn.close()
+            else:
+                self._put_conn(conn)
+            return response, body
+
+    def close(self):
+        """close all idle connections"""
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
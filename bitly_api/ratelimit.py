@@ -0,0 +1,99 @@
+"""
+client side rate limiting for the bitly api
+"""
+import threading
+import time
+
+_now = getattr(time, 'monotonic', time.time)
+
+
+class RateLimiter(object):
+    """
+    a token bucket combined with an adaptive (AIMD) concurrency limit
+
+    at most `rate` requests per second are started, with bursts of up to
+    `burst` requests (default: one second's worth). independently, at most
+    `limit` requests may be in flight at once; `limit` starts at
+    `max_concurrency`, is multiplied by `decrease` whenever a request is
+    rejected with RATE_LIMIT_EXCEEDED and grows back by about one for every
+    `limit` successful requests.
+
+    a single RateLimiter may be shared by any number of threads and asyncio
+    tasks, and by several Connections. threads block in acquire(); event
+    loops poll try_acquire() and sleep for the delay it returns.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=16,
+                 min_concurrency=1, decrease=0.5):
+        assert rate is None or rate > 0
+        assert 0 < min_concurrency <= max_concurrency
+        assert 0 < decrease < 1
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease = decrease
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.rate_limited = 0
+        self._tokens = float(self.burst)
+        self._updated = _now()
+        self._cond = threading.Condition(threading.Lock())
+
+    def try_acquire(self):
+        """
+        take a slot if one is free without blocking. returns 0 on success,
+        otherwise the number of seconds to wait before trying again (None
+        meaning until a request finishes).
+        """
+        with self._cond:
+            return self._try_acquire()
+
+    def _try_acquire(self):
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate is not None:
+            now = _now()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self, timeout=None):
+        """
+        block until a request may be started, or for at most `timeout`
+        seconds. returns whether a slot was taken.
+        """
+        end = None if timeout is None else _now() + timeout
+        with self._cond:
+            while True:
+                delay = self._try_acquire()
+                if delay == 0:
+                    return True
+                if end is not None:
+                    remaining = end - _now()
+                    if remaining <= 0:
+                        return False
+                    if delay is None or delay > remaining:
+                        delay = remaining
+                self._cond.wait(delay)
+
+    def release(self, rate_limited=False):
+        """
+        mark a request as finished. `rate_limited` shrinks the concurrency
+        limit, any other outcome grows it.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.rate_limited += 1
+                self.limit = max(self.min_concurrency,
+                                 self.limit * self.decrease)
+            else:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
@@ -0,0 +1,135 @@
+"""
+compact result objects
+
+with Connection(typed_results=True), shorten() returns a ShortenResult,
+expand() ExpandResult entries and user_link_history() LinkHistoryEntry
+records instead of dicts. their known fields are stored in __slots__, which
+takes a fraction of the memory of a dict per record; keys the api adds that
+aren't known are kept in a small overflow dict.
+
+results behave like read only dicts (result['long_url'], get, keys, items,
+in, ==) so existing code keeps working, and also expose their fields as
+attributes (result.long_url).
+"""
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class Result(object):
+    """base class of the compact results; subclasses set _fields"""
+
+    __slots__ = ('_extra',)
+    _fields = ()
+    _field_set = frozenset()
+
+    def __init__(self, data=(), **kwargs):
+        self._extra = None
+        if isinstance(data, Mapping):
+            data = data.items()
+        for key, value in data:
+            self._set(key, value)
+        for key, value in kwargs.items():
+            self._set(key, value)
+
+    def _set(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for key in self._fields:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Result, Mapping)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+
+def _result_class(name, fields, doc):
+    fields = tuple(fields)
+    return type(name, (Result,), dict(__slots__=fields, __doc__=doc,
+                                      _fields=fields,
+                                      _field_set=frozenset(fields)))
+
+
+ShortenResult = _result_class(
+    'ShortenResult',
+    ['url', 'hash', 'global_hash', 'long_url', 'new_hash'],
+    "the result of Connection.shorten")
+
+ExpandResult = _result_class(
+    'ExpandResult',
+    ['short_url', 'hash', 'user_hash', 'global_hash', 'long_url', 'error'],
+    "one entry of the result of Connection.expand")
+
+LinkHistoryEntry = _result_class(
+    'LinkHistoryEntry',
+    ['link', 'aggregate_link', 'long_url', 'title', 'archived', 'private',
+     'created_at', 'modified_at', 'user_ts', 'client_id', 'keyword_link',
+     'tags', 'encoding_user', 'has_link_deeplinks'],
+    "one link of Connection.user_link_history")
+
+Mapping.register(Result)
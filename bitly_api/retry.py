@@ -0,0 +1,69 @@
+"""
+retrying of transient api failures
+"""
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """
+    when and how long to wait before retrying a failed idempotent call
+
+    a call is attempted at most `max_attempts` times. before retry number n
+    the client sleeps a random time between 0 and
+    min(max_backoff, backoff * 2 ** (n - 1)) seconds ("full jitter"). no retry
+    is started that would end after `deadline` seconds from the first
+    attempt.
+
+    retries are also limited by a budget shared by every call using the
+    policy: each call adds `budget_ratio` to the budget (capped at
+    `min_budget`) and each retry spends one, so once the budget is drained
+    retries make up at most that fraction of traffic instead of multiplying
+    load on an api that is already failing.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.05, max_backoff=2.0,
+                 deadline=10.0, budget_ratio=0.2, min_budget=10):
+        assert max_attempts >= 1
+        assert backoff >= 0 and max_backoff >= 0
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.budget_ratio = budget_ratio
+        self.min_budget = min_budget
+        self.retries = 0
+        self._budget = float(min_budget)
+        self._lock = threading.Lock()
+
+    def retryable(self, error):
+        """is `error` a transient failure worth retrying"""
+        return getattr(error, 'transient', False)
+
+    def start(self):
+        """record a new call; returns the time it started"""
+        with self._lock:
+            self._budget = min(self.min_budget,
+                               self._budget + self.budget_ratio)
+        return time.time()
+
+    def delay(self, attempt, started, error):
+        """
+        the number of seconds to wait before retrying a call that failed with
+        `error` on attempt number `attempt`, or None if it should not be
+        retried
+        """
+        if attempt >= self.max_attempts or not self.retryable(error):
+            return None
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** (attempt - 1)))
+        if (self.deadline is not None and
+                time.time() + delay - started > self.deadline):
+            return None
+        with self._lock:
+            if self._budget < 1:
+                return None
+            self._budget -= 1
+            self.retries += 1
+        return delay
@@ -0,0 +1,67 @@
+"""
+columnar results for time series metrics
+
+with as_arrays=True the time series endpoints return a Series of two
+parallel arrays instead of a list of {'dt': ..., 'clicks': ...} dicts: numpy
+int64 arrays when numpy is installed, array.array otherwise. buckets are
+turned into (dt, count) tuples while the json is parsed, so no per-bucket
+dict is ever built.
+"""
+from __future__ import absolute_import
+
+import functools
+import sys
+from array import array
+from collections import namedtuple
+
+from bitly_api.fastjson import stdlib_loads
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+Series = namedtuple('Series', ['timestamps', 'counts'])
+
+# 64 bit signed integers; array.array has no 'q' before python 3.3
+_TYPECODE = 'q' if sys.version_info >= (3, 3) else 'l'
+
+
+def bucket_pairs_hook(pairs):
+    """
+    json object_pairs_hook that turns {"dt": ts, "<count>": n} buckets into
+    (ts, n) tuples and leaves every other object a dict
+    """
+    if len(pairs) == 2:
+        (k1, v1), (k2, v2) = pairs
+        if k1 == 'dt' and type(v1) is int and type(v2) is int:
+            return (v1, v2)
+        if k2 == 'dt' and type(v2) is int and type(v1) is int:
+            return (v2, v1)
+    return dict(pairs)
+
+
+def to_series(buckets):
+    """build a Series from (ts, count) tuples"""
+    if numpy is not None:
+        if not buckets:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return Series(empty, empty.copy())
+        columns = numpy.array(buckets, dtype=numpy.int64)
+        return Series(columns[:, 0].copy(), columns[:, 1].copy())
+    return Series(array(_TYPECODE, [bucket[0] for bucket in buckets]),
+                  array(_TYPECODE, [bucket[1] for bucket in buckets]))
+
+
+# parses a metrics response, turning its buckets into tuples on the way
+decode_buckets = functools.partial(stdlib_loads,
+                                   object_pairs_hook=bucket_pairs_hook)
+
+
+def find_buckets(data):
+    """the list of bucket tuples in a response decoded with decode_buckets"""
+    for value in data.values():
+        if isinstance(value, list) and (not value or
+                                        isinstance(value[0], tuple)):
+            return value
+    return []
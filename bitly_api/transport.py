@@ -0,0 +1,322 @@
+"""
+pluggable transports, and recording and replaying api traffic
+
+a Connection sends its requests through per host connection pools (see
+bitly_api.pool.HTTPConnectionPool). `Connection(transport=...)` takes any
+object with a pool(scheme, host, maxsize, idle_timeout) method returning
+something with the same urlopen() and close() methods, so requests can be
+recorded, or answered without the network:
+
+    # record the calls an application makes
+    with open('traffic.ndjson', 'w') as f:
+        c = bitly_api.Connection(access_token='...',
+                                 transport=RecordingTransport(f))
+        ...
+
+    # serve the recorded responses back, and replay the traffic at 10x speed
+    records = read_records('traffic.ndjson')
+    c = bitly_api.Connection(access_token='replay',
+                             transport=ReplayTransport(records))
+    report = replay(c, records, speed=10, concurrency=16)
+
+recordings are newline delimited json, one compact object per request:
+
+    {"t":0.153,"scheme":"https","method":"v3/expand",
+     "params":{"hash":["abc"],"access_token":["REDACTED"],...},
+     "status":200,"elapsed":0.041,"bytes":181,"body":"{...}"}
+
+where `t` is the seconds since the first recorded request and `elapsed` how
+long the request took. requests that failed without a response have an
+"error" instead of status, bytes and body. credentials and signatures are
+replaced by REDACTED before anything is written.
+"""
+from __future__ import absolute_import
+import json
+import socket
+import threading
+import time
+
+from bitly_api.bulk import imap
+from bitly_api.pool import HTTPConnectionPool, httplib
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+# query parameters never written to a recording
+REDACTED_PARAMS = frozenset(['access_token', 'apiKey', 'x_apiKey',
+                             'signature', 'client_secret', 'password'])
+REDACTED = 'REDACTED'
+
+# parameters ignored when matching a request to a recording, and dropped
+# when replaying one; the replaying connection adds its own
+_REQUEST_PARAMS = REDACTED_PARAMS | frozenset(['format', 'login', 'x_login',
+                                               't'])
+
+
+class HTTPTransport(object):
+    """the default transport: persistent connections over the network"""
+
+    def __init__(self, pool_class=HTTPConnectionPool):
+        self.pool_class = pool_class
+
+    def pool(self, scheme, host, maxsize=10, idle_timeout=60):
+        return self.pool_class(host, scheme, maxsize=maxsize,
+                               idle_timeout=idle_timeout)
+
+
+def _split_path(path):
+    """return the (method, params) of a request path"""
+    method, _, query = path.partition('?')
+    return method.lstrip('/'), parse_qs(query, keep_blank_values=True)
+
+
+def _redact(params):
+    return dict((k, [REDACTED] * len(v) if k in REDACTED_PARAMS else v)
+                for k, v in params.items())
+
+
+def _request_key(method, params):
+    return (method, tuple(sorted((k, tuple(v)) for k, v in params.items()
+                                 if k not in _REQUEST_PARAMS)))
+
+
+class RecordingTransport(object):
+    """
+    pass every request on to the `inner` transport (default: HTTPTransport)
+    and write it, with its response, as a line of json to the file object
+    `out`. safe to share between threads and connections.
+    """
+
+    def __init__(self, out, inner=None):
+        self.out = out
+        self.inner = inner if inner is not None else HTTPTransport()
+        self._started = None
+        self._lock = threading.Lock()
+
+    def pool(self, scheme, host, maxsize=10, idle_timeout=60):
+        return _RecordingPool(self, scheme,
+                              self.inner.pool(scheme, host, maxsize,
+                                              idle_timeout))
+
+    def begin(self):
+        """the start time of a request about to be sent"""
+        started = time.time()
+        with self._lock:
+            if self._started is None:
+                self._started = started
+        return started
+
+    def record(self, scheme, path, started, elapsed, status=None, body=None,
+               error=None):
+        """write one request"""
+        method, params = _split_path(path)
+        with self._lock:
+            record = {'t': round(started - self._started, 6),
+                      'scheme': scheme, 'method': method,
+                      'params': _redact(params),
+                      'elapsed': round(elapsed, 6)}
+            if error is not None:
+                record['error'] = error
+            else:
+                record['status'] = status
+                record['bytes'] = len(body)
+                record['body'] = body.decode('utf-8', 'replace')
+            self.out.write(json.dumps(record, separators=(',', ':'),
+                                      sort_keys=True) + '\n')
+
+
+class _RecordingPool(object):
+
+    def __init__(self, transport, scheme, pool):
+        self._transport = transport
+        self._scheme = scheme
+        self._pool = pool
+
+    def urlopen(self, path, headers=None, connect_timeout=None,
+                read_timeout=None, timings=None):
+        started = self._transport.begin()
+        try:
+            response, body = self._pool.urlopen(
+                path, headers, connect_timeout, read_timeout, timings)
+        except (socket.error, httplib.HTTPException) as e:
+            self._transport.record(self._scheme, path, started,
+                                   time.time() - started, error=str(e))
+            raise
+        self._transport.record(self._scheme, path, started,
+                               time.time() - started, response.status, body)
+        return response, body
+
+    def close(self):
+        self._pool.close()
+
+
+def read_records(path):
+    """the list of records in the recording file at `path`"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _ReplayResponse(object):
+
+    def __init__(self, status):
+        self.status = status
+
+    def getheader(self, name, default=None):
+        return default
+
+
+_NOT_RECORDED = json.dumps({'status_code': 404, 'status_txt': 'NOT_RECORDED',
+                            'data': None}).encode('utf-8')
+
+
+class ReplayTransport(object):
+    """
+    answer requests from recorded `records` (see read_records) instead of
+    the network. a request is answered by the recordings of the same method
+    and parameters (credentials aside) in turn, starting over once they are
+    used up; unless `strict` is set, a request that wasn't recorded is
+    answered by recordings of the same method. otherwise the response is a
+    404 NOT_RECORDED api error.
+
+    with `latency_scale` set, each response is delayed by its recorded
+    elapsed time multiplied by `latency_scale` (ie: 1.0 for the recorded
+    latency, 0.1 for a server ten times faster).
+    """
+
+    def __init__(self, records, latency_scale=0.0, strict=False):
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._by_request = {}
+        self._by_method = {}
+        for record in records:
+            key = _request_key(record['method'], record['params'])
+            self._by_request.setdefault(key, []).append(record)
+            self._by_method.setdefault(record['method'], []).append(record)
+        self._turns = {}
+        self._lock = threading.Lock()
+
+    def pool(self, scheme, host, maxsize=10, idle_timeout=60):
+        return _ReplayPool(self)
+
+    def lookup(self, method, params):
+        """the recording answering a request, or None"""
+        key = _request_key(method, params)
+        candidates = self._by_request.get(key)
+        if candidates is None and not self.strict:
+            key = method
+            candidates = self._by_method.get(method)
+        if not candidates:
+            return None
+        with self._lock:
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+        return candidates[turn % len(candidates)]
+
+
+class _ReplayPool(object):
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def urlopen(self, path, headers=None, connect_timeout=None,
+                read_timeout=None, timings=None):
+        record = self._transport.lookup(*_split_path(path))
+        delay = 0.0
+        if record is not None and self._transport.latency_scale:
+            delay = record['elapsed'] * self._transport.latency_scale
+            time.sleep(delay)
+        if timings is not None:
+            timings['connect'] = timings['read'] = 0.0
+            timings['ttfb'] = delay
+        if record is None:
+            return _ReplayResponse(200), _NOT_RECORDED
+        if 'error' in record:
+            raise socket.error(record['error'])
+        body = record['body'].encode('utf-8')
+        return _ReplayResponse(record['status']), body
+
+    def close(self):
+        pass
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def replay(connection, records, speed=1.0, concurrency=8):
+    """
+    make the calls of a recording through `connection` on `concurrency`
+    threads, keeping to the recorded timing sped up `speed` times (None: as
+    fast as possible). returns a dict with the number of calls and errors,
+    the offered (scheduled) and achieved calls per second, and latency
+    percentiles in seconds. latencies are measured from when a call was due,
+    so they include time spent waiting for a free thread; at full speed,
+    where every call is due at once, from when a thread starts it.
+    """
+    assert concurrency > 0
+    assert speed is None or speed > 0
+    records = sorted(records, key=lambda record: record['t'])
+    started = time.time()
+
+    def schedule():
+        for record in records:
+            due = started
+            if speed is not None:
+                due += record['t'] / speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield due, record
+
+    def call(item):
+        due, record = item
+        if speed is None:
+            due = time.time()
+        host = (connection.ssl_host if record['scheme'] == 'https'
+                else connection.host)
+        params = dict((k, v if len(v) > 1 else v[0])
+                      for k, v in record['params'].items()
+                      if k not in _REQUEST_PARAMS)
+        error = None
+        try:
+            connection._call(host, record['method'], params)
+        except Exception as e:
+            error = e
+        return time.time() - due, error
+
+    latencies = []
+    errors = 0
+    for latency, error in imap(call, schedule(), workers=concurrency,
+                               ordered=False, max_pending=concurrency):
+        latencies.append(latency)
+        errors += error is not None
+    elapsed = time.time() - started
+    latencies.sort()
+
+    span = records[-1]['t'] - records[0]['t'] if records else 0
+    offered = None
+    if speed is not None and span > 0:
+        offered = len(records) * speed / span
+    return {'speed': speed, 'concurrency': concurrency,
+            'calls': len(records), 'errors': errors,
+            'seconds': elapsed,
+            'offered_rate': offered,
+            'achieved_rate': len(records) / elapsed if elapsed else None,
+            'latency_p50': _percentile(latencies, 0.5),
+            'latency_p99': _percentile(latencies, 0.99),
+            'latency_max': latencies[-1] if latencies else None}
+
+
+def throughput_curve(connection, records, speeds=(1, 2, 5, 10, 20, 50, None),
+                     concurrency=(1, 4, 16)):
+    """
+    replay() `records` at each of `speeds` with each `concurrency`; the list
+    of their reports shows where the achieved rate stops keeping up with the
+    offered one
+    """
+    return [replay(connection, records, speed, workers)
+            for workers in concurrency for speed in speeds]
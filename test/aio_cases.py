@@ -0,0 +1,279 @@
+"""
+offline tests for AsyncConnection, run against a local http server. this
+module needs python 3.7+ and is imported by test_aio.py
+"""
+import asyncio
+import sys
+sys.path.append('../')
+import bitly_api
+from bitly_api.aio import AsyncHTTPConnectionPool
+from test_pool import get_server
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def get_connection(server):
+    bitly = bitly_api.AsyncConnection('login', 'apikey')
+    bitly.host = '127.0.0.1:%d' % server.server_address[1]
+    return bitly
+
+
+def testEndpointsAreCoroutines():
+    for name in ('shorten', 'expand', 'link_clicks', 'bundle_create'):
+        method = getattr(bitly_api.AsyncConnection, name)
+        assert asyncio.iscoroutinefunction(method), name
+
+
+def testValidation():
+    bitly = bitly_api.AsyncConnection('login', 'apikey')
+    try:
+        run(bitly.expand())
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert str(e) == 'MISSING_ARG_SHORTURL'
+
+
+def testConnectionReuse():
+    server = get_server()
+    bitly = get_connection(server)
+
+    async def calls():
+        results = []
+        for _ in range(3):
+            results.append(await bitly.shorten('http://a.com/'))
+        return results
+
+    for data in run(calls()):
+        assert data['path'].startswith('/v3/shorten?')
+    assert len(server.client_ports) == 1
+    server.shutdown()
+
+
+def testReuseAcrossEventLoops():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.retry_policy = False
+    for _ in range(2):
+        data = asyncio.run(bitly.shorten('http://a.com/'))
+        assert data['path'].startswith('/v3/shorten?')
+    # the first loop's idle connection isn't used by the second
+    assert len(server.client_ports) == 2
+    bitly.close()
+    server.shutdown()
+
+
+def testPartialResponseNotResent():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.retry_policy = False
+
+    async def calls():
+        await bitly.shorten('http://a.com/')
+        try:
+            await bitly._fetch(bitly.host, 'v3/truncated', {})
+            assert False, 'expected BitlyError'
+        except bitly_api.BitlyError:
+            pass
+
+    run(calls())
+    paths = [path for path, query in server.requests]
+    assert paths == ['/v3/shorten', '/v3/truncated']
+    server.shutdown()
+
+
+def testConcurrentCalls():
+    server = get_server()
+    bitly = get_connection(server)
+
+    async def calls():
+        return await asyncio.gather(
+            *[bitly.shorten(str(i)) for i in range(20)])
+
+    for i, data in enumerate(run(calls())):
+        assert 'uri=%d&' % i in data['path'] + '&', data
+    server.shutdown()
+
+
+def testTimeout():
+    server = get_server()
+    bitly = get_connection(server)
+
+    async def call():
+        with bitly.timeouts(read=0.1):
+            return await bitly.shorten('http://example.com/slow')
+
+    try:
+        run(call())
+        assert False, 'expected BitlyTimeoutError'
+    except bitly_api.BitlyTimeoutError:
+        pass
+    server.shutdown()
+
+
+def testRedirectIsError():
+    server = get_server()
+    bitly = get_connection(server)
+    try:
+        run(bitly._fetch(bitly.host, 'v3/redirect', dict()))
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert e.code == 301
+    server.shutdown()
+
+
+def testSingleFlight():
+    def respond(path, query):
+        return 200, {'status_code': 200, 'status_txt': 'OK',
+                     'data': {'bitly_pro_domain': True}}
+
+    server = get_server(respond=respond)
+    bitly = bitly_api.AsyncConnection('login', 'apikey',
+                                      single_flight=True)
+    bitly.host = '127.0.0.1:%d' % server.server_address[1]
+
+    async def calls():
+        return await asyncio.gather(
+            *[bitly.pro_domain('slow.com') for _ in range(10)])
+
+    assert run(calls()) == [True] * 10
+    assert len(server.requests) == 1
+    server.shutdown()
+
+
+def testCompression():
+    server = get_server(content_encoding='gzip')
+    bitly = get_connection(server)
+    data = run(bitly.shorten('http://example.com/'))
+    assert data['path'].startswith('/v3/shorten?')
+    assert server.headers[-1]['Accept-Encoding'] == 'gzip, deflate'
+    server.shutdown()
+
+
+def respond_lookup(path, query):
+    if path == '/v3/shorten':
+        data = {'url': 'http://bit.ly/' + query['uri'][0][-1]}
+    elif path == '/v3/link/countries':
+        data = {'countries': [{'country': 'US', 'clicks': 2}]}
+    elif path == '/v3/link/clicks':
+        data = {'link_clicks': 3}
+    else:
+        # expand, info, clicks, clicks_by_day and clicks_by_minute
+        data = {path.split('/')[-1]: [
+            {'hash': h, 'value': path + ':' + h}
+            for h in query.get('hash', [])]}
+    return 200, {'status_code': 200, 'status_txt': 'OK', 'data': data}
+
+
+class PlainPool(AsyncHTTPConnectionPool):
+    def __init__(self, host, scheme='http', maxsize=10, idle_timeout=60):
+        AsyncHTTPConnectionPool.__init__(self, host, 'http', maxsize,
+                                         idle_timeout)
+
+
+def get_oauth_connection(server):
+    bitly = bitly_api.AsyncConnection(access_token='token')
+    bitly.host = bitly.ssl_host = '127.0.0.1:%d' % \
+        server.server_address[1]
+    bitly._pool_class = PlainPool
+    return bitly
+
+
+def collect(generator):
+    async def consume():
+        return [result async for result in generator]
+    return run(consume())
+
+
+def testShortenMany():
+    server = get_server(respond=respond_lookup)
+    bitly = get_connection(server)
+    urls = ['http://a.com/%d' % i for i in range(10)]
+    results = collect(bitly.shorten_many(urls, workers=3))
+    assert [r['url'] for r in results] == \
+        ['http://bit.ly/%d' % i for i in range(10)]
+    server.shutdown()
+
+
+def checkBatchLookup(name, path):
+    server = get_server(respond=respond_lookup)
+    bitly = get_connection(server)
+    hashes = ['h%d' % i for i in range(20)]
+    results = collect(getattr(bitly, name)(hashes, chunk_size=7,
+                                           workers=2))
+    assert [r['value'] for r in results] == \
+        ['%s:%s' % (path, h) for h in hashes]
+    assert len(server.requests) == 3
+    server.shutdown()
+
+
+def testExpandMany():
+    checkBatchLookup('expand_many', '/v3/expand')
+
+
+def testInfoMany():
+    checkBatchLookup('info_many', '/v3/info')
+
+
+def testClicksMany():
+    checkBatchLookup('clicks_many', '/v3/clicks')
+
+
+def testClicksByDayMany():
+    checkBatchLookup('clicks_by_day_many', '/v3/clicks_by_day')
+
+
+def testClicksByMinuteMany():
+    checkBatchLookup('clicks_by_minute_many', '/v3/clicks_by_minute')
+
+
+def testMetricsMany():
+    server = get_server(respond=respond_lookup)
+    bitly = get_oauth_connection(server)
+    links = ['http://bit.ly/%d' % i for i in range(6)]
+    pairs = collect(bitly.metrics_many('link_countries', links,
+                                       workers=2))
+    assert sorted(link for link, _ in pairs) == links
+    for link, countries in pairs:
+        assert countries == [{'country': 'US', 'clicks': 2}]
+    server.shutdown()
+
+
+def testMetricsTotals():
+    server = get_server(respond=respond_lookup)
+    bitly = get_oauth_connection(server)
+    links = ['http://bit.ly/%d' % i for i in range(6)]
+    totals, errors = run(bitly.metrics_totals(
+        'link_countries', links, key='country', workers=2))
+    assert totals == {'US': 12}
+    assert errors == {}
+    totals, errors = run(bitly.metrics_totals('link_clicks', links,
+                                              rollup=True))
+    assert totals == 18
+    server.shutdown()
+
+
+def checkSyncOnly(name, *args):
+    bitly = bitly_api.AsyncConnection(access_token='token')
+    try:
+        getattr(bitly, name)(*args)
+        assert False, 'expected NotImplementedError'
+    except NotImplementedError as e:
+        assert name in str(e)
+
+
+def testIterUserLinkHistory():
+    checkSyncOnly('iter_user_link_history')
+
+
+def testIterUserNetworkHistory():
+    checkSyncOnly('iter_user_network_history')
+
+
+def testExportUserLinkHistory():
+    checkSyncOnly('export_user_link_history', None)
@@ -0,0 +1,27 @@
+"""
+offline tests for the columnar metrics output of AsyncConnection. this module
+needs python 3.7+ and is imported by test_series.py
+"""
+import asyncio
+import sys
+sys.path.append('../')
+import bitly_api
+from test_series import check_series, metrics_body
+
+
+class FakeAsyncConnection(bitly_api.AsyncConnection):
+
+    def __init__(self, field):
+        bitly_api.AsyncConnection.__init__(self, access_token='token')
+        self.body = metrics_body(field)
+
+    async def _request(self, scheme, host, path, timeouts, decode=None,
+                       event=None):
+        return self._parse_response(200, self.body, decode)
+
+
+def testAsyncArrays():
+    bitly = FakeAsyncConnection('link_clicks')
+    series = asyncio.run(bitly.link_clicks('http://bit.ly/a',
+                                           as_arrays=True))
+    check_series(series)
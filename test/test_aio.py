@@ -0,0 +1,10 @@
+"""
+offline tests for AsyncConnection. they need python 3.7+, so they live in
+aio_cases.py, which older pythons can't parse, and are only imported here
+where they can run
+"""
+import sys
+sys.path.append('../')
+
+if sys.version_info >= (3, 7):
+    from aio_cases import *  # noqa
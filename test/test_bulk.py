@@ -0,0 +1,249 @@
+"""
+offline tests for the bulk helpers, run against a local http server
+"""
+import sys
+import threading
+import time
+sys.path.append('../')
+import bitly_api
+from bitly_api.bulk import chunked, imap
+from test_pool import get_server, get_connection
+
+
+def respond_expand(path, query):
+    entries = []
+    # answer short urls first and in reverse to check results are re-ordered
+    for short_url in reversed(query.get('shortUrl', [])):
+        entries.append({'short_url': short_url,
+                        'long_url': 'http://example.com/' + short_url[-1]})
+    for h in query.get('hash', []):
+        if h.startswith('missing'):
+            entries.append({'hash': h, 'error': 'NOT_FOUND'})
+        else:
+            entries.append({'hash': h, 'long_url': 'http://example.com/' + h})
+    return 200, {'status_code': 200, 'status_txt': 'OK',
+                 'data': {'expand': entries}}
+
+
+def testChunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+
+def testImapOrdered():
+    def slow(i):
+        time.sleep(0.001 * (10 - i))
+        return i * 2
+    assert list(imap(slow, range(10), workers=4)) == [i * 2 for i in range(10)]
+    unordered = list(imap(slow, range(10), workers=4, ordered=False))
+    assert sorted(unordered) == [i * 2 for i in range(10)]
+
+
+def testImapBoundedPending():
+    pulled = []
+    lock = threading.Lock()
+
+    def source():
+        for i in range(100):
+            with lock:
+                pulled.append(i)
+            yield i
+
+    results = imap(lambda i: i, source(), workers=2, max_pending=4)
+    assert next(results) == 0
+    time.sleep(0.05)
+    assert len(pulled) <= 6
+    assert list(results) == list(range(1, 100))
+
+
+def testImapExceptions():
+    def fail_odd(i):
+        if i % 2:
+            raise ValueError(i)
+        return i
+    results = list(imap(fail_odd, range(4), return_exceptions=True))
+    assert results[0] == 0 and isinstance(results[1], ValueError)
+    try:
+        list(imap(fail_odd, range(4)))
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def testExpandMany():
+    server = get_server(respond=respond_expand)
+    bitly = get_connection(server)
+    links = ['h%d' % i for i in range(20)]
+    links[3] = 'http://bit.ly/x'
+    links[7] = 'missing1'
+    links[12] = 'http://bit.ly/y'
+    results = list(bitly.expand_many(links, chunk_size=5))
+    assert len(results) == 20
+    assert len(server.requests) == 4
+    assert results[0]['long_url'] == 'http://example.com/h0'
+    assert results[3]['long_url'] == 'http://example.com/x'
+    assert results[7]['error'] == 'NOT_FOUND'
+    assert results[12]['long_url'] == 'http://example.com/y'
+    assert results[19]['long_url'] == 'http://example.com/h19'
+    server.shutdown()
+
+
+def testCoalescedExpand():
+    server = get_server(respond=respond_expand)
+    bitly = bitly_api.Connection('login', 'apikey', coalesce_window=0.2,
+                                 coalesce_max=10)
+    bitly.host = '127.0.0.1:%d' % server.server_address[1]
+    results = {}
+
+    def expand(i):
+        results[i] = bitly.expand(hash='h%d' % i)
+
+    threads = [threading.Thread(target=expand, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server.requests) == 2
+    for i in range(20):
+        assert results[i] == [{'hash': 'h%d' % i,
+                               'long_url': 'http://example.com/h%d' % i}]
+    server.shutdown()
+
+
+def testCoalescerError():
+    def lookup(links):
+        raise bitly_api.BitlyError(403, 'RATE_LIMIT_EXCEEDED')
+    coalescer = bitly_api.bulk.Coalescer(lookup, window=0)
+    try:
+        coalescer.submit('a')
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert e.code == 403
+
+
+def testCoalescerTimeout():
+    def lookup(links):
+        time.sleep(0.3)
+        return links
+    coalescer = bitly_api.bulk.Coalescer(lookup, window=0.05)
+    leader = threading.Thread(target=coalescer.submit, args=('a',))
+    leader.start()
+    time.sleep(0.01)
+    start = time.time()
+    try:
+        coalescer.submit('b', timeout=0.1)
+        assert False, 'expected CoalesceTimeout'
+    except bitly_api.bulk.CoalesceTimeout:
+        pass
+    assert time.time() - start < 0.25
+    leader.join()
+
+
+def testCoalescedCallDeadline():
+    server = get_server(respond=respond_expand)
+    bitly = bitly_api.Connection('login', 'apikey', coalesce_window=0.05)
+    bitly.host = '127.0.0.1:%d' % server.server_address[1]
+    # the batch's request is slow to answer (see test_pool.Handler)
+    leader = threading.Thread(target=bitly.expand, args=('slow',))
+    leader.start()
+    time.sleep(0.01)
+    try:
+        with bitly.timeouts(deadline=0.1):
+            bitly.expand(hash='b')
+        assert False, 'expected BitlyTimeoutError'
+    except bitly_api.BitlyTimeoutError:
+        pass
+    leader.join()
+    server.shutdown()
+
+
+def testShortenMany():
+    def respond(path, query):
+        uri = query['uri'][0]
+        if uri == 'bad':
+            return 200, {'status_code': 500, 'status_txt': 'INVALID_URI'}
+        return 200, {'status_code': 200, 'status_txt': 'OK',
+                     'data': {'long_url': uri, 'hash': uri[-1]}}
+
+    server = get_server(respond=respond)
+    bitly = get_connection(server)
+    uris = ['http://example.com/%d' % i for i in range(10)]
+    uris[4] = 'bad'
+    results = list(bitly.shorten_many(iter(uris), workers=3))
+    assert len(results) == 10
+    assert isinstance(results[4], bitly_api.BitlyError)
+    assert str(results[4]) == 'INVALID_URI'
+    for i, result in enumerate(results):
+        if i != 4:
+            assert result['long_url'] == uris[i]
+    unordered = list(bitly.shorten_many(uris, workers=3, ordered=False))
+    assert len(unordered) == 10
+    server.shutdown()
+
+
+def testSingleFlight():
+    def respond(path, query):
+        time.sleep(0.2)
+        return respond_expand(path, query)
+
+    server = get_server(respond=respond)
+    bitly = get_connection(server)
+    bitly._single_flight = bitly_api.bulk.SingleFlight()
+    results = []
+
+    def expand():
+        results.append(bitly.expand(hash='viral'))
+
+    threads = [threading.Thread(target=expand) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server.requests) == 1
+    assert len(results) == 10 and results[0][0]['hash'] == 'viral'
+    # mutating calls are never shared
+    threads = [threading.Thread(target=bitly.shorten, args=('http://a/',))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server.requests) == 4
+    server.shutdown()
+
+
+class MetricsConnection(bitly_api.Connection):
+    """serves link metrics without the network; link 'bad' fails"""
+
+    def link_countries(self, link, unit=None):
+        if link == 'bad':
+            raise bitly_api.BitlyError(404, 'NOT_FOUND')
+        return [{'country': 'US', 'clicks': 2}, {'country': 'DE', 'clicks': 1}]
+
+    def link_clicks(self, link, rollup=None, unit=None, units=None):
+        if rollup:
+            return 3
+        return [{'dt': 1360000000 - i * 86400, 'clicks': i}
+                for i in range(units)]
+
+
+def testMetricsMany():
+    bitly = MetricsConnection(access_token='token')
+    links = ['http://bit.ly/%d' % i for i in range(20)] + ['bad']
+    results = dict(bitly.metrics_many('link_countries', iter(links),
+                                      workers=3, unit='day'))
+    assert set(results) == set(links)
+    assert isinstance(results['bad'], bitly_api.BitlyError)
+    assert results[links[0]][0]['country'] == 'US'
+
+    totals, errors = bitly.metrics_totals('link_countries', links,
+                                          key='country')
+    assert totals == {'US': 40, 'DE': 20}
+    assert list(errors) == ['bad']
+    totals, errors = bitly.metrics_totals('link_clicks', links[:20],
+                                          rollup=True)
+    assert totals == 60 and not errors
+    # time series buckets are summed too
+    totals, errors = bitly.metrics_totals('link_clicks', links[:20],
+                                          unit='day', units=3)
+    assert totals == 60 and not errors
@@ -0,0 +1,178 @@
+"""
+offline tests for response caching
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+sys.path.append('../')
+import bitly_api
+from test_pool import get_server, get_connection
+from test_bulk import respond_expand
+
+
+def testLRUCache():
+    cache = bitly_api.LRUCache(maxsize=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1' and cache.get('c') == '3'
+    stats = cache.stats()
+    assert stats['hits'] == 3 and stats['misses'] == 1
+    assert stats['evictions'] == 1 and stats['size'] == 2
+
+
+def testTTL():
+    cache = bitly_api.LRUCache()
+    cache.set('a', '1', ttl=0.01)
+    cache.set('b', '2', ttl=None)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.get('b') == '2'
+    assert cache.stats()['expirations'] == 1
+
+
+def testCachedExpand():
+    server = get_server(respond=respond_expand)
+    bitly = get_connection(server)
+    bitly.cache = bitly_api.LRUCache()
+    first = bitly.expand(hash='abc')
+    assert bitly.expand(hash=['abc']) == first
+    assert bitly.expand(hash='abc') == first
+    assert len(server.requests) == 1
+    bitly.expand(hash='def')
+    assert len(server.requests) == 2
+    # methods without a ttl aren't cached
+    bitly.cache_ttls = {}
+    bitly.expand(hash='abc')
+    assert len(server.requests) == 3
+    server.shutdown()
+
+
+def testNotFoundCachedBriefly():
+    server = get_server(respond=respond_expand)
+    bitly = get_connection(server)
+    ttls = []
+
+    class Cache(bitly_api.LRUCache):
+        def set(self, key, value, ttl=None):
+            ttls.append(ttl)
+            bitly_api.LRUCache.set(self, key, value, ttl)
+
+    bitly.cache = Cache()
+    assert bitly.expand(hash='missing1')[0]['error'] == 'NOT_FOUND'
+    bitly.expand(hash='abc')
+    assert ttls == [bitly_api.bitly_api.NEGATIVE_CACHE_TTL, None]
+    server.shutdown()
+
+
+def testSqliteCache():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    cache = bitly_api.SqliteCache(path, maxsize=2, trim_interval=1)
+    cache.set('a', '1')
+    cache.set('b', '2', ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('a') == '1'
+    assert cache.get('b') is None
+    # a second instance (ie: in another process) sees the same entries
+    other = bitly_api.SqliteCache(path)
+    assert other.get('a') == '1'
+    for key in 'cde':
+        cache.set(key, key)
+    assert cache.stats()['size'] == 2
+    assert cache.get('e') == 'e'
+
+
+class FakeMemcached(threading.Thread):
+    """just enough of the memcached text protocol for MemcacheCache"""
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.data = {}
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.address = '127.0.0.1:%d' % self.listener.getsockname()[1]
+
+    def run(self):
+        sock, _ = self.listener.accept()
+        stream = sock.makefile('rwb')
+        while True:
+            parts = stream.readline().split()
+            if not parts:
+                return
+            if parts[0] == b'get':
+                value = self.data.get(parts[1])
+                if value is not None:
+                    stream.write(b'VALUE ' + parts[1] + b' 0 ' +
+                                 str(len(value)).encode() + b'\r\n' +
+                                 value + b'\r\n')
+                stream.write(b'END\r\n')
+            elif parts[0] == b'set':
+                self.data[parts[1]] = stream.read(int(parts[4]) + 2)[:-2]
+                stream.write(b'STORED\r\n')
+            stream.flush()
+
+
+def testMemcacheCache():
+    server = FakeMemcached()
+    server.start()
+    cache = bitly_api.MemcacheCache([server.address])
+    assert cache.get('v3/expand?hash=a') is None
+    cache.set('v3/expand?hash=a', '{"data": 1}', ttl=None)
+    assert cache.get('v3/expand?hash=a') == '{"data": 1}'
+    assert len(server.data) == 1
+    assert cache.stats() == dict(hits=1, misses=1, errors=0)
+
+
+def testMemcacheUnavailable():
+    cache = bitly_api.MemcacheCache(['127.0.0.1:1'])
+    assert cache.get('a') is None
+    cache.set('a', 'b')
+    assert cache.errors == 2
+
+
+def testShortenCachedPerUser():
+    def respond(path, query):
+        return 200, {'status_code': 200, 'status_txt': 'OK',
+                     'data': {'long_url': query['uri'][0],
+                              'user': query['login'][0]}}
+
+    server = get_server(respond=respond)
+    cache = bitly_api.LRUCache()
+    alice = get_connection(server)
+    alice.cache = cache
+    alice.login = 'alice'
+    bob = get_connection(server)
+    bob.cache = cache
+    bob.login = 'bob'
+    assert alice.shorten('http://example.com/')['user'] == 'alice'
+    assert alice.shorten('http://example.com/')['user'] == 'alice'
+    assert bob.shorten('http://example.com/')['user'] == 'bob'
+    assert len(server.requests) == 2
+    server.shutdown()
+
+
+def testNoCredentialsInCacheKey():
+    def respond(path, query):
+        return 200, {'status_code': 200, 'status_txt': 'OK',
+                     'data': {'long_url': query['uri'][0],
+                              'user': query.get('x_login', ['?'])[0]}}
+
+    server = get_server(respond=respond)
+    bitly = get_connection(server)
+    bitly.cache = bitly_api.LRUCache()
+    assert bitly.shorten('http://example.com/', x_login='bob',
+                         x_apiKey='R_SECRET')['user'] == 'bob'
+    assert bitly.shorten('http://example.com/', x_login='eve',
+                         x_apiKey='R_OTHER')['user'] == 'eve'
+    keys = list(bitly.cache._data)
+    assert len(keys) == 2
+    assert not [key for key in keys if 'R_' in key]
+    assert [key for key in keys if 'user=bob' in key]
+    server.shutdown()
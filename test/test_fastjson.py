@@ -0,0 +1,64 @@
+"""
+offline tests for response decoding and field selection
+"""
+import json
+import sys
+sys.path.append('../')
+import bitly_api
+from bitly_api.fastjson import loads, select_fields
+from test_bulk import respond_expand
+from test_pool import get_server, get_connection
+
+
+def link(i):
+    return {'link': 'http://bit.ly/%d' % i, 'created_at': 1000 + i,
+            'long_url': 'http://example.com/%d' % i, 'title': 'x' * 100,
+            'encoding_user': {'login': 'user%d' % i, 'display_name': 'U'},
+            'tags': ['a', 'b']}
+
+
+def history_body(count):
+    return json.dumps({'status_code': 200, 'status_txt': 'OK',
+                       'data': {'link_history': [link(i)
+                                                 for i in range(count)],
+                                'result_count': count}}).encode('utf-8')
+
+
+def testLoadsBytes():
+    body = history_body(3)
+    assert loads(body) == json.loads(body.decode('utf-8'))
+
+
+def testSelectFields():
+    decode = select_fields(['created_at', 'encoding_user.login'], ['link'])
+    assert select_fields(['created_at', 'encoding_user.login'],
+                         ['link']) is decode
+    data = decode(history_body(3))
+    assert data['status_code'] == 200
+    assert data['data']['result_count'] == 3
+    assert data['data']['link_history'][1] == {
+        'link': 'http://bit.ly/1', 'created_at': 1001,
+        'encoding_user.login': 'user1'}
+
+
+class HistoryConnection(bitly_api.Connection):
+    """answers user_link_history without the network"""
+
+    def _request(self, scheme, host, path, timeouts, decode=None,
+                 event=None):
+        return self._parse_response(200, history_body(5), decode)
+
+
+def testLinkHistoryFields():
+    bitly = HistoryConnection(access_token='token')
+    links = bitly.user_link_history(fields=['created_at'])
+    assert links[0] == {'link': 'http://bit.ly/0', 'created_at': 1000}
+    assert bitly.user_link_history()[0] == link(0)
+
+
+def testExpandFields():
+    server = get_server(respond=respond_expand)
+    bitly = get_connection(server)
+    entries = bitly.expand(hash=['a', 'missing'], fields=['long_url'])
+    assert entries == [{'hash': 'a', 'long_url': 'http://example.com/a'},
+                       {'hash': 'missing', 'error': 'NOT_FOUND'}]
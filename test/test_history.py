@@ -0,0 +1,143 @@
+"""
+offline tests for the history pagers, run against a fake connection
+"""
+import csv
+import json
+import sys
+sys.path.append('../')
+import bitly_api
+from bitly_api.history import LinkHistoryPager, NetworkHistoryPager
+
+try:
+    # python 2's csv and json write byte strings
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class FakeConnection(bitly_api.Connection):
+    """serves user_link_history from a list of links, newest first"""
+
+    def __init__(self, links):
+        bitly_api.Connection.__init__(self, access_token='token')
+        self.links = sorted(links, key=lambda l: -l['created_at'])
+        self.calls = []
+
+    def user_link_history(self, created_before=None, created_after=None,
+                          archived=None, limit=None, offset=None,
+                          private=None, fields=None):
+        self.calls.append(dict(created_before=created_before,
+                               created_after=created_after, offset=offset,
+                               fields=fields))
+        links = [l for l in self.links
+                 if (created_before is None or
+                     l['created_at'] < created_before) and
+                 (created_after is None or l['created_at'] > created_after)]
+        offset = offset or 0
+        links = links[offset:offset + limit]
+        if fields is not None:
+            links = [dict((k, l[k]) for k in fields if k in l)
+                     for l in links]
+        return links
+
+    def user_network_history(self, offset=None, expand_client_id=False,
+                             limit=None, expand_user=False):
+        return dict(entries=self.links[offset:offset + limit],
+                    total=len(self.links))
+
+
+def make_links(count):
+    # several links per second to exercise page boundaries within a second
+    return [dict(link='http://bit.ly/%d' % i, created_at=1000 + i // 3)
+            for i in range(count)]
+
+
+def testLinkHistoryPager():
+    bitly = FakeConnection(make_links(50))
+    for prefetch in (True, False):
+        links = list(LinkHistoryPager(bitly, page_size=7, prefetch=prefetch))
+        assert links == bitly.links
+    # no deep offsets are used
+    assert max(call['offset'] or 0 for call in bitly.calls) <= 3
+
+
+def testPageSizeLimit():
+    bitly = FakeConnection(make_links(5))
+    for call in (lambda: bitly.iter_user_link_history(page_size=200),
+                 lambda: bitly.export_user_link_history(None, page_size=200)):
+        try:
+            call()
+            assert False, "expected an AssertionError"
+        except AssertionError as e:
+            assert 'page_size' in str(e)
+
+
+def testLinkHistoryFilters():
+    bitly = FakeConnection(make_links(50))
+    links = list(bitly.iter_user_link_history(created_before=1010,
+                                              created_after=1002,
+                                              page_size=4))
+    assert [l['created_at'] for l in links] == \
+        [l['created_at'] for l in bitly.links if 1002 < l['created_at'] < 1010]
+
+
+def testLinkHistoryCheckpoint():
+    bitly = FakeConnection(make_links(50))
+    pager = bitly.iter_user_link_history(page_size=5)
+    seen = []
+    for link in pager:
+        seen.append(link)
+        if len(seen) == 17:
+            break
+    checkpoint = pager.checkpoint()
+    rest = list(bitly.iter_user_link_history(page_size=5,
+                                             checkpoint=checkpoint))
+    assert seen + rest == bitly.links
+
+
+def testNetworkHistoryPager():
+    bitly = FakeConnection(make_links(20))
+    pager = NetworkHistoryPager(bitly, page_size=6)
+    entries = []
+    for entry in pager:
+        entries.append(entry)
+        if len(entries) == 8:
+            break
+    assert pager.checkpoint() == dict(offset=8)
+    rest = list(bitly.iter_user_network_history(
+        page_size=6, checkpoint=pager.checkpoint()))
+    assert entries + rest == bitly.links
+
+
+def testExportNDJSON():
+    links = make_links(300)
+    # a burst of links in a single second
+    links += [dict(link='http://bit.ly/burst%d' % i, created_at=1050)
+              for i in range(25)]
+    bitly = FakeConnection(links)
+    out = StringIO()
+    written = bitly.export_user_link_history(
+        out, created_after=999, created_before=1200, shards=3, workers=3,
+        page_size=10)
+    exported = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert written == len(links)
+    assert exported == bitly.links
+
+
+def testExportCSV():
+    title = u'caf\xe9'
+    links = make_links(40)
+    for link in links:
+        link['title'] = title
+    bitly = FakeConnection(links)
+    out = StringIO()
+    bitly.export_user_link_history(out, format='csv', created_after=999,
+                                   created_before=1100, page_size=8,
+                                   fields=['link', 'title', 'created_at'])
+    rows = list(csv.DictReader(StringIO(out.getvalue())))
+    assert [row['link'] for row in rows] == [l['link'] for l in bitly.links]
+    if sys.version_info[0] < 3:
+        title = title.encode('utf-8')
+    assert all(row['title'] == title for row in rows)
+    assert all(call['fields'] == ['link', 'title', 'created_at']
+               for call in bitly.calls)
@@ -0,0 +1,73 @@
+"""
+offline tests for call instrumentation, run against a local http server
+"""
+import sys
+sys.path.append('../')
+import bitly_api
+from bitly_api.instrument import prometheus_text, statsd_text
+from test_bulk import respond_expand
+from test_pool import get_server, get_connection
+
+
+class Events(bitly_api.Instrumentation):
+    def __init__(self):
+        self.events = []
+
+    def record(self, event):
+        self.events.append(event)
+
+
+def testCallEvents():
+    server = get_server(respond=respond_expand)
+    bitly = get_connection(server)
+    bitly.instrumentation = events = Events()
+    bitly.cache = bitly_api.LRUCache()
+    bitly.expand(hash='a')
+    bitly.expand(hash='a')
+    first, second = events.events
+    assert first.method == 'v3/expand' and first.status == 200
+    assert first.cache == 'miss' and first.attempts == 1
+    assert first.bytes > 0 and first.ttfb > 0 and first.parse_time > 0
+    assert first.total_time >= first.ttfb + first.read_time
+    assert second.cache == 'hit' and second.attempts == 0
+
+    try:
+        bitly._call(bitly.host, 'v3/redirect', dict())
+    except bitly_api.BitlyError:
+        pass
+    assert events.events[-1].status == 301
+    assert events.events[-1].error is not None
+
+
+def testHistogramCollector():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.instrumentation = stats = bitly_api.HistogramCollector()
+    for i in range(5):
+        bitly.shorten('http://example.com/%d' % i)
+    assert stats.methods() == ['v3/shorten']
+    method = stats.stats('v3/shorten')
+    assert method.count == 5 and method.statuses == {200: 5}
+    assert stats.quantile('v3/shorten', 0.5) is not None
+
+    text = prometheus_text(stats)
+    assert '# TYPE bitly_api_call_duration_seconds histogram' in text
+    assert 'bitly_api_call_duration_seconds_bucket{method="v3/shorten",' \
+        'le="+Inf"} 5' in text
+    assert 'bitly_api_calls_total{method="v3/shorten",status="200"} 5' in text
+    assert 'bitly_api.v3.shorten.calls:5|g' in statsd_text(stats).split('\n')
+
+
+if sys.version_info >= (3, 7):
+    import asyncio
+
+    def testAsyncEvents():
+        server = get_server()
+        bitly = bitly_api.AsyncConnection('login', 'apikey')
+        bitly.host = '127.0.0.1:%d' % server.server_address[1]
+        bitly.instrumentation = events = Events()
+        asyncio.run(bitly.shorten('http://example.com/'))
+        event, = events.events
+        assert event.status == 200 and event.attempts == 1
+        assert event.bytes > 0 and event.ttfb > 0
+        server.shutdown()
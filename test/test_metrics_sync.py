@@ -0,0 +1,70 @@
+"""
+offline tests for incremental metrics syncing, run against a fake connection
+"""
+import os
+import sys
+import tempfile
+import time
+sys.path.append('../')
+import bitly_api
+
+HOUR = 3600
+
+
+class FakeConnection(object):
+    """serves hourly link_clicks buckets: `clicks` clicks every hour"""
+
+    def __init__(self):
+        self.calls = []
+        self.clicks = 1
+
+    def link_clicks(self, link, unit=None, units=None, rollup=None,
+                    unit_reference_ts=None):
+        assert unit == 'hour' and rollup is False
+        self.calls.append(units)
+        current = unit_reference_ts - unit_reference_ts % HOUR
+        return [dict(dt=current - i * HOUR, clicks=self.clicks)
+                for i in range(units)]
+
+
+def check_sync(store):
+    bitly = FakeConnection()
+    sync = bitly_api.MetricsSync(bitly, store, initial_units=24)
+    series = sync.sync('link_clicks', 'http://bit.ly/a', unit='hour')
+    assert len(series) == 24
+    assert series[0]['dt'] > series[-1]['dt']
+    key = sync.key('link_clicks', 'http://bit.ly/a', 'hour')
+    current = int(time.time()) // HOUR * HOUR
+    assert store.watermark(key) == current - HOUR
+
+    # the next poll only asks for the last couple of buckets
+    bitly.clicks = 5
+    series = sync.sync('link_clicks', 'http://bit.ly/a', unit='hour')
+    assert bitly.calls[-1] <= 3
+    assert len(series) == 24
+    assert series[0]['clicks'] == 5 and series[-1]['clicks'] == 1
+
+
+def testMemoryStore():
+    check_sync(bitly_api.MemoryMetricsStore())
+
+
+def testSqliteStore():
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.db')
+    check_sync(bitly_api.SqliteMetricsStore(path))
+
+
+def testLongGapIsPaged():
+    bitly = FakeConnection()
+    store = bitly_api.MemoryMetricsStore()
+    sync = bitly_api.MetricsSync(bitly, store, initial_units=2, max_units=10)
+    key = sync.key('link_clicks', 'http://bit.ly/a', 'hour')
+    current = int(time.time()) // HOUR * HOUR
+    # last synced 25 hours ago
+    store.merge(key, [], current - 25 * HOUR)
+    sync.update('link_clicks', 'http://bit.ly/a', unit='hour')
+    assert bitly.calls == [10, 10, 6]
+    dts = set(bucket['dt'] for bucket in store.series(key))
+    # every bucket since the old watermark is stored
+    assert dts >= set(current - i * HOUR for i in range(26))
+    assert store.watermark(key) == current - HOUR
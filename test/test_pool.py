@@ -0,0 +1,277 @@
+"""
+offline tests for the persistent connection pool, run against a local http
+server
+"""
+import gzip
+import hashlib
+import io
+import json
+import sys
+import threading
+import time
+import zlib
+sys.path.append('../')
+import bitly_api
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.client_ports.add(self.client_address[1])
+        url = urlparse(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query)))
+        self.server.headers.append(self.headers)
+        if 'slow' in self.path:
+            time.sleep(0.5)
+        if self.path.startswith('/v3/truncated'):
+            # answer, then drop the connection halfway through the body
+            self.send_response(200)
+            self.send_header('Content-Length', '100')
+            self.end_headers()
+            self.wfile.write(b'{"status_code": 200')
+            self.close_connection = True
+            return
+        if self.path.startswith('/v3/redirect'):
+            code, body = 301, b'moved'
+        elif self.server.respond:
+            code, data = self.server.respond(url.path, parse_qs(url.query))
+            body = json.dumps(data).encode('utf-8')
+        else:
+            code = 200
+            body = json.dumps({'status_code': 200, 'status_txt': 'OK',
+                               'data': {'path': self.path}}).encode('utf-8')
+        self.send_response(code)
+        encoding = self.server.content_encoding
+        if encoding and encoding in self.headers.get('Accept-Encoding', ''):
+            body = compress(body, encoding)
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop_connections:
+            # close without telling the client, like an idle server timeout
+            self.close_connection = True
+
+
+def compress(body, encoding):
+    if encoding == 'deflate':
+        return zlib.compress(body)
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(body)
+    return out.getvalue()
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def get_server(drop_connections=False, respond=None, content_encoding=None):
+    """
+    start a local api server. `respond(path, query)` may return the
+    (status, json data) to answer each request with. with `content_encoding`
+    (gzip or deflate) responses are compressed for clients that accept it.
+    """
+    server = Server(('127.0.0.1', 0), Handler)
+    server.client_ports = set()
+    server.requests = []
+    server.headers = []
+    server.content_encoding = content_encoding
+    server.drop_connections = drop_connections
+    server.respond = respond
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def get_connection(server):
+    bitly = bitly_api.Connection('login', 'apikey')
+    bitly.host = '127.0.0.1:%d' % server.server_address[1]
+    return bitly
+
+
+def testConnectionReuse():
+    server = get_server()
+    bitly = get_connection(server)
+    for _ in range(3):
+        data = bitly._call(bitly.host, 'v3/expand', dict(hash='a'))
+        assert data['data']['path'].startswith('/v3/expand?')
+    assert len(server.client_ports) == 1
+    server.shutdown()
+
+
+def testReconnectAfterServerClose():
+    server = get_server(drop_connections=True)
+    bitly = get_connection(server)
+    for _ in range(3):
+        bitly._call(bitly.host, 'v3/expand', dict(hash='a'))
+    assert len(server.client_ports) == 3
+    server.shutdown()
+
+
+def testPartialResponseNotResent():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.retry_policy = False
+    bitly._call(bitly.host, 'v3/expand', dict(hash='a'))
+    # the request goes out on the reused connection and is answered in part
+    try:
+        bitly._call(bitly.host, 'v3/truncated', dict())
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError:
+        pass
+    paths = [path for path, query in server.requests]
+    assert paths == ['/v3/expand', '/v3/truncated']
+    server.shutdown()
+
+
+def testRedirectIsError():
+    server = get_server()
+    bitly = get_connection(server)
+    try:
+        bitly._call(bitly.host, 'v3/redirect', dict())
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert e.code == 301
+    server.shutdown()
+
+
+def testIdleTimeout():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.pool_idle_timeout = -1
+    bitly._call(bitly.host, 'v3/expand', dict(hash='a'))
+    bitly._call(bitly.host, 'v3/expand', dict(hash='a'))
+    assert len(server.client_ports) == 2
+    bitly.close()
+    server.shutdown()
+
+
+def testReadTimeout():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.read_timeout = 0.1
+    bitly.retry_policy = False
+    start = time.time()
+    try:
+        bitly.shorten('http://example.com/slow')
+        assert False, 'expected BitlyTimeoutError'
+    except bitly_api.BitlyTimeoutError as e:
+        assert e.code == 504 and e.transient
+    assert time.time() - start < 0.4
+    server.shutdown()
+
+
+def testDeadlineCoversRetries():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly.retry_policy = bitly_api.RetryPolicy(max_attempts=10, backoff=0.01)
+    start = time.time()
+    try:
+        with bitly.timeouts(read=0.1, deadline=0.35):
+            bitly.expand(shortUrl='http://bit.ly/slow')
+        assert False, 'expected BitlyTimeoutError'
+    except bitly_api.BitlyTimeoutError:
+        pass
+    assert time.time() - start < 0.5
+    assert 2 <= len(server.requests) <= 4
+    server.shutdown()
+
+
+def testPerCallTimeout():
+    server = get_server()
+    bitly = get_connection(server)
+    try:
+        bitly._call(bitly.host, 'v3/slow', dict(), timeout=100)
+        assert False, 'expected BitlyTimeoutError'
+    except bitly_api.BitlyTimeoutError:
+        pass
+    server.shutdown()
+
+
+def testJsonDecoder():
+    server = get_server(respond=lambda path, query: (200, {
+        'status_code': 200, 'status_txt': 'OK',
+        'data': {'bitly_pro_domain': True}}))
+    bodies = []
+
+    def decoder(body):
+        bodies.append(body)
+        return json.loads(body.decode('utf-8'))
+    bitly = get_connection(server)
+    bitly.json_decoder = decoder
+    assert bitly.pro_domain('example.com') is True
+    assert len(bodies) == 1 and isinstance(bodies[0], bytes)
+
+    # malformed bodies are still transient errors with readable messages
+    try:
+        bitly_api.Connection._parse_response(200, b'<html>')
+    except bitly_api.BitlyError as e:
+        assert e.transient and str(e) == '<html>'
+    else:
+        assert False, "expected BitlyError"
+
+
+def testCompression():
+    for encoding in ('gzip', 'deflate'):
+        server = get_server(content_encoding=encoding)
+        bitly = get_connection(server)
+        data = bitly._call(bitly.host, 'v3/compressed', dict())
+        assert data['data']['path'].startswith('/v3/compressed')
+        assert server.headers[-1]['Accept-Encoding'] == 'gzip, deflate'
+
+    # raw deflate, which some servers send for "deflate"
+    from bitly_api.pool import Decompressor
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    raw = compressor.compress(b'{"a": 1}' * 1000) + compressor.flush()
+    decompressor = Decompressor('deflate')
+    body = decompressor.decompress(raw[:10]) + \
+        decompressor.decompress(raw[10:]) + decompressor.flush()
+    assert body == b'{"a": 1}' * 1000
+
+    bitly = get_connection(server)
+    bitly.compress = False
+    bitly._call(bitly.host, 'v3/plain', dict())
+    assert server.headers[-1].get('Accept-Encoding') in (None, 'identity')
+
+
+def testSignedCall():
+    server = get_server()
+    bitly = get_connection(server)
+    bitly._call(bitly.host, 'v3/expand', dict(hash=['a', 'b']), 'secret')
+    path, query = server.requests[-1]
+    # md5 of the values in key order, then the secret
+    values = [query['apiKey'][0], query['format'][0], 'a', 'b',
+              query['login'][0], query['t'][0], 'secret']
+    expected = hashlib.md5(''.join(values).encode('utf-8')).hexdigest()[:10]
+    assert query['signature'] == [expected]
+
+
+def testRequestPath():
+    bitly = bitly_api.Connection('login', 'apikey')
+    scheme, host, path = bitly._build_request(
+        bitly.host, 'v3/expand', dict(hash=['a', 'b'], shortUrl=None))
+    assert path == '/v3/expand?format=json&login=login&apiKey=apikey' \
+        '&hash=a&hash=b'
+    assert bitly._build_request(bitly.host, 'v3/expand', dict())[2] == \
+        '/v3/expand?format=json&login=login&apiKey=apikey'
+    # changed credentials are picked up
+    bitly.access_token = 'token'
+    scheme, host, path = bitly._build_request(bitly.host, 'v3/expand',
+                                              dict(hash='a'))
+    assert (scheme, host) == ('https', bitly.ssl_host)
+    assert path == '/v3/expand?format=json&access_token=token&hash=a'
@@ -0,0 +1,92 @@
+"""
+offline tests for the client side rate limiter
+"""
+import sys
+import time
+sys.path.append('../')
+import bitly_api
+from test_pool import get_server, get_connection
+
+
+def testTokenBucket():
+    limiter = bitly_api.RateLimiter(rate=100, burst=5)
+    start = time.time()
+    for _ in range(15):
+        limiter.acquire()
+        limiter.release()
+    # 5 burst tokens, then 10 more at 100/s
+    assert time.time() - start >= 0.09
+
+
+def testConcurrencyLimit():
+    limiter = bitly_api.RateLimiter(max_concurrency=2)
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() is None
+    limiter.release()
+    assert limiter.try_acquire() == 0
+
+
+def testAIMD():
+    limiter = bitly_api.RateLimiter(max_concurrency=8)
+    limiter.acquire()
+    limiter.release(rate_limited=True)
+    assert limiter.limit == 4
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(rate_limited=True)
+    assert limiter.limit == 1
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 8
+
+
+def testConnectionRateLimits():
+    def respond(path, query):
+        if path == '/v3/shorten':
+            return 200, {'status_code': 403,
+                         'status_txt': 'RATE_LIMIT_EXCEEDED'}
+        return 200, {'status_code': 200, 'status_txt': 'OK',
+                     'data': {'link_lookup': []}}
+
+    server = get_server(respond=respond)
+    bitly = get_connection(server)
+    shorten_limiter = bitly_api.RateLimiter(max_concurrency=4)
+    default_limiter = bitly_api.RateLimiter(max_concurrency=4)
+    bitly.rate_limits = {'v3/shorten': shorten_limiter, '': default_limiter}
+    try:
+        bitly.shorten('http://example.com/')
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert e.code == 403
+    bitly.user_link_lookup('http://example.com/')
+    assert shorten_limiter.limit == 2 and shorten_limiter.rate_limited == 1
+    assert default_limiter.limit == 4 and default_limiter.in_flight == 0
+    server.shutdown()
+
+
+def testAcquireTimeout():
+    limiter = bitly_api.RateLimiter(max_concurrency=1)
+    assert limiter.acquire(timeout=0.05)
+    start = time.time()
+    assert not limiter.acquire(timeout=0.05)
+    assert 0.04 <= time.time() - start < 1
+
+
+def testRateLimitWaitBoundedByDeadline():
+    server = get_server()
+    bitly = get_connection(server)
+    limiter = bitly_api.RateLimiter(max_concurrency=1)
+    limiter.acquire()
+    bitly.rate_limits = {'': limiter}
+    start = time.time()
+    try:
+        with bitly.timeouts(deadline=0.1):
+            bitly.shorten('http://example.com/')
+        assert False, 'expected BitlyTimeoutError'
+    except bitly_api.BitlyTimeoutError:
+        pass
+    assert time.time() - start < 1
+    assert server.requests == []
+    server.shutdown()
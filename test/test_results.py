@@ -0,0 +1,48 @@
+"""
+offline tests for the compact result objects
+"""
+import json
+import pickle
+import sys
+sys.path.append('../')
+from bitly_api.results import ExpandResult, LinkHistoryEntry
+from test_bulk import respond_expand
+from test_pool import get_server, get_connection
+
+
+def testDictAccess():
+    data = {'hash': 'a', 'long_url': 'http://example.com/', 'new': 1}
+    result = ExpandResult(data)
+    assert result['long_url'] == result.long_url == 'http://example.com/'
+    assert result['new'] == 1 and result.get('error') is None
+    assert 'hash' in result and 'error' not in result
+    assert result == data and dict(result) == data
+    assert sorted(result.keys()) == sorted(data)
+    assert json.loads(json.dumps(result.to_dict())) == data
+    assert pickle.loads(pickle.dumps(result)) == result
+    assert not hasattr(result, '__dict__')
+    try:
+        result['error']
+    except KeyError:
+        pass
+    else:
+        assert False, "expected KeyError"
+
+
+def testTypedResults():
+    server = get_server(respond=respond_expand)
+    bitly = get_connection(server)
+    bitly.typed_results = True
+    entries = bitly.expand(hash=['a', 'missing'])
+    assert all(isinstance(entry, ExpandResult) for entry in entries)
+    assert entries[0]['long_url'] == 'http://example.com/a'
+    assert entries[1]['error'] == 'NOT_FOUND'
+    assert [e['long_url'] for e in bitly.expand_many(['b', 'c'])] == \
+        ['http://example.com/b', 'http://example.com/c']
+
+
+def testLinkHistoryEntry():
+    entry = LinkHistoryEntry(link='http://bit.ly/a', created_at=1000,
+                             tags=['x'])
+    assert entry.created_at == 1000 and entry['tags'] == ['x']
+    assert len(entry) == 3
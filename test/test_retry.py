@@ -0,0 +1,73 @@
+"""
+offline tests for retrying transient failures
+"""
+import sys
+sys.path.append('../')
+import bitly_api
+from test_pool import get_server, get_connection
+
+
+def flaky(failures):
+    """respond with a 503 to the first `failures` requests"""
+    state = {'count': 0}
+
+    def respond(path, query):
+        state['count'] += 1
+        if state['count'] <= failures:
+            return 503, {}
+        return 200, {'status_code': 200, 'status_txt': 'OK',
+                     'data': {'expand': [], 'hash': 'a'}}
+    return respond
+
+
+def testRetryIdempotent():
+    server = get_server(respond=flaky(2))
+    bitly = get_connection(server)
+    bitly.retry_policy = bitly_api.RetryPolicy(max_attempts=3, backoff=0.001)
+    assert bitly.expand(hash='a') == []
+    assert len(server.requests) == 3
+    assert bitly.retry_policy.retries == 2
+    server.shutdown()
+
+
+def testMaxAttempts():
+    server = get_server(respond=flaky(5))
+    bitly = get_connection(server)
+    bitly.retry_policy = bitly_api.RetryPolicy(max_attempts=2, backoff=0.001)
+    try:
+        bitly.expand(hash='a')
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert e.code == 503 and e.transient
+    assert len(server.requests) == 2
+    server.shutdown()
+
+
+def testNoRetryForMutatingCalls():
+    server = get_server(respond=flaky(1))
+    bitly = get_connection(server)
+    try:
+        bitly.shorten('http://example.com/')
+        assert False, 'expected BitlyError'
+    except bitly_api.BitlyError as e:
+        assert e.code == 503
+    assert len(server.requests) == 1
+    server.shutdown()
+
+
+def testRetryBudget():
+    policy = bitly_api.RetryPolicy(max_attempts=5, backoff=0, min_budget=2)
+    error = bitly_api.BitlyError(500, 'boom', transient=True)
+    started = policy.start()
+    assert policy.delay(1, started, error) == 0
+    assert policy.delay(2, started, error) == 0
+    assert policy.delay(3, started, error) is None
+    assert policy.delay(1, started, bitly_api.BitlyError(500, 'INVALID_URI')) \
+        is None
+
+
+def testRetryDeadline():
+    policy = bitly_api.RetryPolicy(backoff=10, max_backoff=10, deadline=0)
+    error = bitly_api.BitlyError(500, 'boom', transient=True)
+    delays = [policy.delay(1, policy.start(), error) for _ in range(20)]
+    assert all(delay is None or delay == 0 for delay in delays)
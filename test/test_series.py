@@ -0,0 +1,68 @@
+"""
+offline tests for the columnar (as_arrays) metrics output
+"""
+import json
+import sys
+sys.path.append('../')
+import bitly_api
+
+BUCKETS = [dict(dt=1360000000 - i * 3600, clicks=i * 2) for i in range(5)]
+
+
+def metrics_body(field):
+    return json.dumps(dict(status_code=200, status_txt='OK', data={
+        'unit': 'hour', 'units': 5, 'tz_offset': 0,
+        'unit_reference_ts': 1360000000, field: BUCKETS})).encode('utf-8')
+
+
+class FakeConnection(bitly_api.Connection):
+    """answers every request with a canned metrics response"""
+
+    def __init__(self, field):
+        bitly_api.Connection.__init__(self, access_token='token')
+        self.body = metrics_body(field)
+        self.paths = []
+
+    def _request(self, scheme, host, path, timeouts, decode=None,
+                 event=None):
+        self.paths.append(path)
+        return self._parse_response(200, self.body, decode)
+
+
+def check_series(series):
+    assert list(series.timestamps) == [b['dt'] for b in BUCKETS]
+    assert list(series.counts) == [b['clicks'] for b in BUCKETS]
+    assert len(series.timestamps) == len(series.counts) == 5
+
+
+def testLinkClicksArrays():
+    bitly = FakeConnection('link_clicks')
+    series = bitly.link_clicks('http://bit.ly/a', unit='hour', units=5,
+                               as_arrays=True)
+    assert isinstance(series, bitly_api.Series)
+    check_series(series)
+    assert 'rollup=false' in bitly.paths[-1]
+    # without the flag the response is unchanged
+    assert bitly.link_clicks('http://bit.ly/a', unit='hour') == BUCKETS
+
+
+def testOtherEndpoints():
+    check_series(FakeConnection('user_clicks').user_clicks(as_arrays=True))
+    check_series(FakeConnection('user_shorten_counts').user_shorten_counts(
+        as_arrays=True))
+    check_series(FakeConnection('tracking_domain_clicks')
+                 .user_tracking_domain_clicks('example.com', as_arrays=True))
+
+
+def testBucketsHook():
+    data = bitly_api.series.decode_buckets(
+        '{"a": {"dt": 1, "shortens": 2}, "b": {"x": 1, "dt": 2}, '
+        '"c": {"dt": 1.5, "n": 2}}')
+    assert data == {'a': (1, 2), 'b': (2, 1), 'c': {'dt': 1.5, 'n': 2}}
+    series = bitly_api.series.to_series([])
+    assert len(series.timestamps) == len(series.counts) == 0
+
+
+if sys.version_info >= (3, 7):
+    # async syntax older pythons can't parse
+    from series_aio_cases import *  # noqa
@@ -0,0 +1,120 @@
+"""
+offline tests for recording and replaying api traffic
+"""
+import json
+import sys
+sys.path.append('../')
+import bitly_api
+from bitly_api.transport import (RecordingTransport, ReplayTransport,
+                                 replay, throughput_curve)
+from test_bulk import respond_expand
+from test_pool import get_server, get_connection
+
+
+class Lines(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def records(self):
+        return [json.loads(line) for line in ''.join(self.lines).splitlines()]
+
+
+def record(calls):
+    server = get_server(respond=respond_expand)
+    out = Lines()
+    bitly = get_connection(server)
+    bitly.transport = RecordingTransport(out)
+    for params, secret in calls:
+        bitly._call(bitly.host, 'v3/expand', params, secret)
+    server.shutdown()
+    return out.records()
+
+
+def testRecording():
+    records = record([(dict(hash='a'), None),
+                      (dict(hash=['b', 'c']), 'secret')])
+    assert [r['method'] for r in records] == ['v3/expand', 'v3/expand']
+    assert records[0]['t'] == 0
+    assert records[1]['t'] >= 0
+    assert records[0]['status'] == 200
+    assert json.loads(records[0]['body'])['data']['expand'][0]['hash'] == 'a'
+    assert records[0]['bytes'] == len(records[0]['body'])
+    params = records[1]['params']
+    assert params['hash'] == ['b', 'c']
+    assert params['login'] == ['login']
+    # no credentials or signatures are written
+    assert params['apiKey'] == params['signature'] == ['REDACTED']
+    assert 'apikey' not in json.dumps(records)
+
+
+def testReplay():
+    records = record([(dict(hash='a'), None), (dict(hash='b'), None)])
+    bitly = bitly_api.Connection('other', 'key',
+                                 transport=ReplayTransport(records))
+    assert bitly.expand(hash='b') == [{'hash': 'b',
+                                       'long_url': 'http://example.com/b'}]
+    assert bitly.expand(hash='a')[0]['long_url'] == 'http://example.com/a'
+    # unrecorded calls get a response recorded for the method
+    assert len(bitly.expand(hash='z')) == 1
+
+    bitly = bitly_api.Connection('other', 'key', retry_policy=False,
+                                 transport=ReplayTransport(records,
+                                                           strict=True))
+    try:
+        bitly.expand(hash='z')
+        assert False, "expected NOT_RECORDED"
+    except bitly_api.BitlyError as e:
+        assert e.code == 404
+    try:
+        bitly.shorten('http://example.com/')
+        assert False, "expected NOT_RECORDED"
+    except bitly_api.BitlyError as e:
+        assert str(e) == 'NOT_RECORDED'
+
+
+def testReplayErrors():
+    records = [{'t': 0, 'scheme': 'http', 'method': 'v3/expand',
+                'params': {'hash': ['a']}, 'elapsed': 0.1,
+                'error': 'connection reset'},
+               {'t': 0, 'scheme': 'http', 'method': 'v3/expand',
+                'params': {'hash': ['b']}, 'elapsed': 0.1, 'status': 503,
+                'bytes': 4, 'body': 'oops'}]
+    bitly = bitly_api.Connection('login', 'key', retry_policy=False,
+                                 transport=ReplayTransport(records))
+    for h in ('a', 'b'):
+        try:
+            bitly.expand(hash=h)
+            assert False, "expected a BitlyError"
+        except bitly_api.BitlyError as e:
+            assert e.transient
+
+
+def testLoadDriver():
+    records = record([(dict(hash=h), None) for h in 'abcdefgh'])
+    bitly = bitly_api.Connection('other', 'key',
+                                 transport=ReplayTransport(records))
+    report = replay(bitly, records, speed=None, concurrency=4)
+    assert report['calls'] == 8
+    assert report['errors'] == 0
+    assert report['achieved_rate'] > 0
+    assert report['latency_p50'] <= report['latency_p99']
+
+    curve = throughput_curve(bitly, records, speeds=(1000, None),
+                             concurrency=(1, 2))
+    assert [(r['speed'], r['concurrency']) for r in curve] == \
+        [(1000, 1), (None, 1), (1000, 2), (None, 2)]
+
+
+def testFullSpeedLatency():
+    records = [{'t': 0, 'scheme': 'http', 'method': 'v3/expand',
+                'params': {'hash': ['a']}, 'elapsed': 0.01, 'status': 200,
+                'bytes': 2, 'body': '{"status_code": 200, "data": {}}'}] * 10
+    bitly = bitly_api.Connection('login', 'key', transport=ReplayTransport(
+        records, latency_scale=1.0))
+    report = replay(bitly, records, speed=None, concurrency=1)
+    # latency is the time of each call, not its position in the queue
+    assert report['seconds'] >= 0.1
+    assert report['latency_p99'] < 0.05